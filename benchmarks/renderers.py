@@ -0,0 +1,81 @@
+"""
+Benchmark of the renderers and parsers of the API.
+
+Encodes and decodes a page of messages shaped like the output of
+:class:`core.serializers.MessageSerializer` with every format, and
+reports the time per page and the size of the payload::
+
+    python benchmarks/renderers.py --iterations 2000
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'la_comunita.settings')
+
+import django  # NOQA: Needs the settings module.
+django.setup()
+
+from rest_framework.parsers import JSONParser  # NOQA
+from rest_framework.renderers import JSONRenderer  # NOQA
+
+from core.parsers import MessagePackParser, UJSONParser  # NOQA
+from core.renderers import MessagePackRenderer, UJSONRenderer  # NOQA
+
+FORMATS = (
+    ('json', JSONRenderer, JSONParser),
+    ('ujson', UJSONRenderer, UJSONParser),
+    ('msgpack', MessagePackRenderer, MessagePackParser),
+)
+
+
+def message_page(size=50):
+    """Returns a paginated page of messages."""
+    base = 'http://api.lacomunita.co'
+    results = [{
+        'url': '%s/messages/%d/' % (base, i),
+        'content': 'Nos vemos en la plaza a las %d, ¿quién trae la '
+                   'comida?' % (i % 24),
+        'date_sent': '2015-07-%02dT18:%02d:12.481516Z' % (i % 28 + 1,
+                                                          i % 60),
+        'sender': '%s/users/%d/' % (base, i % 7),
+        'seen_by': ['%s/users/%d/' % (base, u) for u in range(i % 5)],
+        'chat': '%s/chats/3/' % base,
+    } for i in range(size)]
+    return {'count': 10 * size, 'next': '%s/messages/?page=2' % base,
+            'previous': None, 'results': results}
+
+
+def timeit(func, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        func()
+    return 1000000 * (time.time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--page-size', type=int, default=50)
+    args = parser.parse_args()
+
+    page = message_page(args.page_size)
+    print('%-8s %12s %12s %10s' % ('format', 'encode (us)', 'decode (us)',
+                                   'size (B)'))
+    for name, renderer_class, parser_class in FORMATS:
+        renderer, parser_ = renderer_class(), parser_class()
+        payload = renderer.render(page)
+        encode = timeit(lambda: renderer.render(page), args.iterations)
+        decode = timeit(lambda: parser_.parse(io.BytesIO(payload)),
+                        args.iterations)
+        print('%-8s %12.1f %12.1f %10d' % (name, encode, decode,
+                                           len(payload)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark of the startup of a web worker.
+
+Boots the WSGI application and loads the URLs in a fresh interpreter
+for every settings module, as a gunicorn worker does before serving
+its first request, and reports the boot time, the peak memory and
+the number of imported modules::
+
+    python benchmarks/startup.py --max-seconds 1.5 --max-rss-mb 60
+
+With `--max-seconds` or `--max-rss-mb`, the benchmark fails if the
+production settings exceed them, so that it can guard against
+regressions.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = ('la_comunita.settings', 'la_comunita.settings_production')
+PRODUCTION = 'la_comunita.settings_production'
+
+BOOT = '''
+import json, resource, sys, time
+start = time.time()
+from la_comunita.wsgi import application
+from django.core.urlresolvers import get_resolver
+get_resolver(None).url_patterns
+print(json.dumps({
+    'seconds': time.time() - start,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': len(sys.modules),
+}))
+'''
+
+
+def boot(settings_module):
+    """Boots a worker with the given settings in a new interpreter
+    and returns its measurements."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    env.setdefault('SECRET_KEY', 'startup-benchmark')
+    env.setdefault('ALLOWED_HOSTS', 'localhost')
+    output = subprocess.check_output([sys.executable, '-c', BOOT],
+                                     cwd=ROOT, env=env)
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float)
+    parser.add_argument('--max-rss-mb', type=float)
+    args = parser.parse_args()
+
+    results = {}
+    print('%-35s %10s %10s %8s' % ('settings', 'boot (s)', 'rss (MB)',
+                                   'modules'))
+    for profile in PROFILES:
+        runs = [boot(profile) for _ in range(args.repeat)]
+        results[profile] = {key: median([run[key] for run in runs])
+                            for key in runs[0]}
+        print('%-35s %10.3f %10.1f %8d' % (
+            profile, results[profile]['seconds'],
+            results[profile]['rss_mb'], results[profile]['modules']))
+
+    production = results[PRODUCTION]
+    failures = []
+    if args.max_seconds and production['seconds'] > args.max_seconds:
+        failures.append('boot time %.3fs > %.3fs' %
+                        (production['seconds'], args.max_seconds))
+    if args.max_rss_mb and production['rss_mb'] > args.max_rss_mb:
+        failures.append('memory %.1fMB > %.1fMB' %
+                        (production['rss_mb'], args.max_rss_mb))
+    for failure in failures:
+        print('FAIL: %s' % failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
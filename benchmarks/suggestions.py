@@ -0,0 +1,96 @@
+"""
+Benchmark of the suggested groups of a user.
+
+Creates a throwaway test database with random memberships, builds
+the co-membership index and measures the time to compute the
+suggestions of random users::
+
+    python benchmarks/suggestions.py --memberships 1000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'la_comunita.settings')
+
+import django  # NOQA: Needs the settings module.
+django.setup()
+
+from django.db import connection  # NOQA
+from django.test.utils import setup_test_environment  # NOQA
+
+from core.models import Community, Group, User  # NOQA
+from core.recommendations import (rebuild_group_affinity,  # NOQA
+                                  suggested_groups)
+
+BATCH_SIZE = 10000
+
+
+def populate(users, groups, memberships):
+    """Creates the users, groups and random memberships. Signals are
+    not fired, the index is built afterwards."""
+    User.objects.bulk_create(User(username='user%d' % i)
+                             for i in range(users))
+    community = Community.objects.create(name='community')
+    Group.objects.bulk_create(Group(name='group%d' % i,
+                                    community=community)
+                              for i in range(groups))
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    group_ids = list(Group.objects.values_list('pk', flat=True))
+
+    through = Group.users.through
+    pairs = set()
+    while len(pairs) < memberships:
+        pairs.add((random.choice(user_ids), random.choice(group_ids)))
+    pairs = list(pairs)
+    for i in range(0, len(pairs), BATCH_SIZE):
+        through.objects.bulk_create(
+            through(user_id=u, group_id=g)
+            for u, g in pairs[i:i + BATCH_SIZE])
+    return user_ids, group_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--memberships', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--groups', type=int, default=20000)
+    parser.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        start = time.time()
+        user_ids, group_ids = populate(args.users, args.groups,
+                                       args.memberships)
+        print('populate: %.1fs' % (time.time() - start))
+
+        start = time.time()
+        for group_id in group_ids:
+            rebuild_group_affinity(group_id)
+        elapsed = time.time() - start
+        print('index build: %.1fs (%.2fms per group)' %
+              (elapsed, 1000 * elapsed / len(group_ids)))
+
+        timings = []
+        for user_id in random.sample(user_ids, args.samples):
+            user = User(pk=user_id)
+            start = time.time()
+            suggested_groups(user)
+            timings.append(1000 * (time.time() - start))
+        timings.sort()
+        print('suggestions: p50 %.2fms, p99 %.2fms, max %.2fms' %
+              (timings[len(timings) // 2],
+               timings[int(len(timings) * 0.99)], timings[-1]))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,3 +12,5 @@ class CoreConfig(AppConfig):
 
     def ready(self):
         from core.signals import handlers  # NOQA: This is ok
+        from core.middleware import check_pin_cache
+        check_pin_cache()
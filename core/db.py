@@ -0,0 +1,56 @@
+"""
+Module that routes the queries between the primary database and
+its read replicas.
+
+Reads go to a random replica in `DATABASE_REPLICAS` and writes go
+to the `default` database. Reads are sent to the primary instead
+while the current thread is pinned to it, which happens during
+unsafe requests, during the `REPLICA_PIN_SECONDS` that follow a
+write of the same client (see
+:class:`core.middleware.ReplicaPinningMiddleware`) and while
+tasks run, so that they see the writes that enqueued them.
+"""
+
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_state = threading.local()
+
+
+def is_pinned():
+    """Whether the reads of the current thread go to the primary."""
+    return getattr(_state, 'pinned', False)
+
+
+def set_pinned(pinned):
+    _state.pinned = pinned
+
+
+@contextmanager
+def pin_primary():
+    """Sends the reads of the block to the primary."""
+    previous = is_pinned()
+    set_pinned(True)
+    try:
+        yield
+    finally:
+        set_pinned(previous)
+
+
+class PrimaryReplicaRouter(object):
+    """Sends reads to the replicas and writes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or is_pinned():
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
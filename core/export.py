@@ -0,0 +1,90 @@
+"""
+Module that streams the history of a chat in a flat format
+(NDJSON or CSV) without loading the whole history in memory.
+"""
+
+import csv
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+EXPORT_CHUNK_SIZE = 500
+EXPORT_FIELDS = ('id', 'date_sent', 'sender', 'content')
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo(object):
+    """Pseudo buffer that returns what is written to it, so that
+    :class:`csv.writer` can be used to format single rows."""
+
+    def write(self, value):
+        return value
+
+
+def iter_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields lists of rows from a `values_list` queryset whose
+    first column is the primary key.
+
+    The rows are fetched with keyset pagination (`pk > last_pk`)
+    instead of `.iterator()`, because the database drivers we use
+    buffer the full result set on the client side. This keeps
+    the memory bounded by `chunk_size` regardless of the size
+    of the table.
+    """
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk)
+                             .order_by('pk')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1][0]
+
+
+def ndjson_lines(chunks):
+    """Formats every chunk of rows as a block of NDJSON lines."""
+    encoder = DjangoJSONEncoder()
+    for chunk in chunks:
+        yield ''.join(encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n'
+                      for row in chunk)
+
+
+def csv_lines(chunks):
+    """Formats every chunk of rows as a block of CSV lines, preceded
+    by a header."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for chunk in chunks:
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+
+def gzip_stream(blocks):
+    """Compresses a stream of text blocks into a gzip stream."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for block in blocks:
+        data = compressor.compress(block.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_messages(queryset, type_, compress=False):
+    """Returns an iterable with the serialized messages of
+    the queryset.
+
+    :param queryset: The messages to export.
+    :type queryset: ..class:`django.db.models.QuerySet`.
+    :param type_: The output format, either `ndjson` or `csv`.
+    :type type_: str.
+    :param compress: Whether the output is gzip compressed.
+    :type compress: bool."""
+    rows = queryset.values_list('id', 'date_sent',
+                                'sender__username', 'content')
+    formatter = ndjson_lines if type_ == 'ndjson' else csv_lines
+    blocks = formatter(iter_chunks(rows))
+    if compress:
+        return gzip_stream(blocks)
+    return blocks
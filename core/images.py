@@ -0,0 +1,114 @@
+"""
+Module that generates the thumbnails of the pictures of users
+and joinables.
+
+Thumbnails are stored by the SHA-1 of the original picture,
+so two entities that share the same picture also share
+their thumbnails, and a picture is only processed once.
+"""
+
+import hashlib
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .tasks import task
+
+_format = None
+
+
+def thumbnail_format():
+    """Returns the format used to save the thumbnails. WebP
+    is preferred when Pillow was built with support for it.
+
+    Pillow is imported on first use, so that the web workers
+    that only serialize the URLs of the thumbnails do not pay
+    for loading it at startup."""
+    global _format
+    if _format is None:
+        from PIL import Image
+        Image.init()
+        _format = 'WEBP' if 'WEBP' in Image.SAVE else 'JPEG'
+    return _format
+
+
+def thumbnail_name(digest, variant):
+    """Returns the storage name of the `variant` thumbnail of the
+    picture whose content hashes to `digest`."""
+    extension = thumbnail_format().lower()
+    return 'thumbnails/%s/%s/%s.%s' % (digest[:2], digest, variant,
+                                       extension)
+
+
+def generate_thumbnails(field_file):
+    """Generates every thumbnail in `THUMBNAIL_SIZES` for the
+    given picture. Thumbnails that already exist are skipped.
+
+    :param field_file: The picture to process.
+    :type field_file: ..class:`django.db.models.fields.files.FieldFile`.
+    :returns: The SHA-1 of the content of the picture.
+    """
+    from PIL import Image, ImageOps
+
+    field_file.open('rb')
+    try:
+        content = field_file.read()
+    finally:
+        field_file.close()
+    digest = hashlib.sha1(content).hexdigest()
+
+    image = None
+    format_ = thumbnail_format()
+    for variant, size in settings.THUMBNAIL_SIZES.items():
+        name = thumbnail_name(digest, variant)
+        if default_storage.exists(name):
+            continue
+        if image is None:
+            image = Image.open(BytesIO(content)).convert('RGB')
+        thumbnail = ImageOps.fit(image, tuple(size), Image.ANTIALIAS)
+        buf = BytesIO()
+        thumbnail.save(buf, format_, quality=85)
+        default_storage.save(name, ContentFile(buf.getvalue()))
+    return digest
+
+
+def picture_key(model, pk, field):
+    return 'thumbnails:%s:%s:%s' % (model, pk, field)
+
+
+@task(key=picture_key)
+def process_picture(model, pk, field):
+    """Generates the thumbnails of the picture stored in `field` of
+    the given instance and records the hash of the picture
+    in `<field>_hash`.
+
+    :param model: The model of the instance, as `app_label.ModelName`.
+    :type model: str.
+    """
+    model = apps.get_model(model)
+    try:
+        instance = model._default_manager.get(pk=pk)
+    except model.DoesNotExist:
+        return
+    digest = generate_thumbnails(getattr(instance, field))
+    model._default_manager.filter(pk=pk).update(**{field + '_hash': digest})
+
+
+def schedule_thumbnails(instance, field):
+    """Enqueues the generation of the thumbnails of a new picture, so
+    that requests do not wait for the image processing.
+
+    The hash of the previous picture is cleared first, so that the
+    original picture is served instead of the thumbnails of the
+    previous one until the task finishes."""
+    hash_field = field + '_hash'
+    if getattr(instance, hash_field):
+        setattr(instance, hash_field, '')
+        (instance._default_manager.filter(pk=instance.pk)
+                                  .update(**{hash_field: ''}))
+    opts = instance._meta
+    process_picture.enqueue('%s.%s' % (opts.app_label, opts.object_name),
+                            instance.pk, field)
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from core.db import pin_primary
+from core.models import Chat, InboxEntry
+
+
+def backfill(chats):
+    """Records the last message of the chats that have none, and
+    creates the missing inbox entries of their members. Returns the
+    number of entries created."""
+    for chat in chats:
+        if chat.last_activity_at is not None:
+            continue
+        message = chat.messages.order_by('-date_sent', '-pk').first()
+        if message is not None:
+            chat.record_message(message)
+            chat.last_activity_at = message.date_sent
+    activity = {c.pk: c.last_activity_at or c.created_on for c in chats}
+    existing = set(InboxEntry.objects.filter(chat__in=chats)
+                                     .values_list('user', 'chat'))
+    members = (Chat.users.through.objects.filter(chat__in=chats)
+                                         .values_list('user', 'chat'))
+    entries = [InboxEntry(user_id=user, chat_id=chat,
+                          last_activity_at=activity[chat])
+               for user, chat in members if (user, chat) not in existing]
+    InboxEntry.objects.bulk_create(entries)
+    return len(entries)
+
+
+class Command(BaseCommand):
+    help = ('Creates the inbox entries of the chat memberships that '
+            'existed before the inbox, and records the last message of '
+            'their chats. It can be run again safely.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Chats processed per batch.')
+
+    def handle(self, *args, **options):
+        created = last_pk = 0
+        with pin_primary():
+            while True:
+                chats = Chat.objects.filter(pk__gt=last_pk).order_by('pk')
+                chats = list(chats[:options['batch_size']])
+                if not chats:
+                    break
+                created += backfill(chats)
+                last_pk = chats[-1].pk
+        self.stdout.write('created %d inbox entries' % created)
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.db import pin_primary
+from core.retention import JOBS
+
+
+class Command(BaseCommand):
+    help = ('Deletes the messages, read receipts and invitations that '
+            'are older than the retention of their community, and the '
+            'old entries of the sync changelog.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('jobs', nargs='*',
+                            help='Jobs to run, among %s. Defaults to all '
+                                 'of them.' %
+                                 ', '.join(job.name for job in JOBS))
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows scanned per batch.')
+        parser.add_argument('--sleep', type=float, default=0.1,
+                            help='Seconds to wait between batches.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        names = options['jobs'] or [job.name for job in JOBS]
+        unknown = set(names) - set(job.name for job in JOBS)
+        if unknown:
+            raise CommandError('Unknown jobs: %s' % ', '.join(sorted(unknown)))
+        with pin_primary():
+            for job in JOBS:
+                if job.name in names:
+                    self.run(job, options['batch_size'], options['sleep'])
+
+    def run(self, job, batch_size, sleep):
+        start = time.time()
+        scanned = deleted = 0
+        for batch_scanned, batch_deleted in job.run(batch_size, sleep):
+            scanned += batch_scanned
+            deleted += batch_deleted
+            if self.verbosity > 1:
+                self.stdout.write('%s: scanned %d, deleted %d' %
+                                  (job.name, scanned, deleted))
+        elapsed = time.time() - start
+        self.stdout.write('%s: deleted %d rows of %d scanned in %.1fs '
+                          '(%.0f rows/s)' %
+                          (job.name, deleted, scanned, elapsed,
+                           deleted / elapsed if elapsed else 0))
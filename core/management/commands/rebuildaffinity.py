@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.db import pin_primary
+from core.models import Group
+from core.recommendations import rebuild_group_affinity
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the co-membership index used to suggest groups '
+            'from the current memberships. Joins and leaves that happen '
+            'while it runs may be counted twice, so run it when the '
+            'index is empty, e.g. after deploying the suggestions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('groups', nargs='*', type=int,
+                            help='Ids of the groups to rebuild. Defaults '
+                                 'to all of them.')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        with pin_primary():
+            ids = options['groups'] or list(
+                Group.objects.order_by('pk').values_list('pk', flat=True))
+            for count, group_id in enumerate(ids, 1):
+                rebuild_group_affinity(group_id)
+                if options['verbosity'] > 1 and count % 1000 == 0:
+                    self.stdout.write('rebuilt %d of %d groups' %
+                                      (count, len(ids)))
+        self.stdout.write('rebuilt the neighbours of %d groups in %.1fs' %
+                          (len(ids), time.time() - start))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.tasks import get_queue
+
+
+class Command(BaseCommand):
+    help = 'Consumes the task queue, or reports its depth and lag.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats', action='store_true',
+                            help='Print the depth and lag of the queue '
+                                 'and exit.')
+
+    def handle(self, *args, **options):
+        queue = get_queue()
+        if options['stats']:
+            self.stdout.write('depth: %d' % queue.depth())
+            self.stdout.write('lag: %.3fs' % queue.lag())
+            return
+        if not hasattr(queue, 'work'):
+            raise CommandError('%s runs the tasks in the web process, '
+                               'there is nothing to consume.' %
+                               queue.__class__.__name__)
+        queue.work()
@@ -0,0 +1,58 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from .db import set_pinned
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',
+                'django.core.cache.backends.dummy.DummyCache')
+
+
+def check_pin_cache():
+    """Refuses to start when there are read replicas but the pins
+    would be kept in a cache that other workers can not see, which
+    would let clients read stale data after writing."""
+    middleware = 'core.middleware.ReplicaPinningMiddleware'
+    backend = settings.CACHES['default']['BACKEND']
+    if (settings.DATABASE_REPLICAS and
+            middleware in settings.MIDDLEWARE_CLASSES and
+            backend in LOCAL_CACHES):
+        raise ImproperlyConfigured(
+            'DATABASE_REPLICAS requires a default cache shared by all '
+            'the workers, but %s is local to each process.' % backend)
+
+
+def pin_key(request):
+    """Returns the cache key that pins the client of the request
+    to the primary database, or None for anonymous clients."""
+    auth = request.META.get('HTTP_AUTHORIZATION')
+    if not auth:
+        return None
+    return 'replica-pin:%s' % hashlib.sha1(auth.encode('utf-8')).hexdigest()
+
+
+class ReplicaPinningMiddleware(object):
+    """Pins the reads of a request to the primary database if the
+    request writes, or if its client wrote less than
+    `REPLICA_PIN_SECONDS` ago, so that clients always see their
+    own messages and joins despite the replication lag.
+
+    The pins are kept in the default cache, which must be shared
+    by all the workers for them to work across processes (see
+    :func:`check_pin_cache`).
+    """
+
+    def process_request(self, request):
+        key = pin_key(request)
+        set_pinned(request.method not in SAFE_METHODS or
+                   (key is not None and bool(cache.get(key))))
+
+    def process_response(self, request, response):
+        key = pin_key(request)
+        if request.method not in SAFE_METHODS and key is not None:
+            cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+        set_pinned(False)
+        return response
@@ -7,6 +7,9 @@ from django.contrib.auth.models import User
 User.add_to_class('profile_picture',
                   models.ImageField(default='/profile/placeholder.png',
                                     upload_to='profile'))
+User.add_to_class('profile_picture_hash',
+                  models.CharField(max_length=40, blank=True,
+                                   editable=False))
 
 
 class Joinable(models.Model):
@@ -23,6 +26,8 @@ class Joinable(models.Model):
     picture = models.ImageField(
         upload_to='joinable',
         default='/joinable/placeholder.png')
+    picture_hash = models.CharField(max_length=40, blank=True,
+                                    editable=False)
 
     class Meta:
         abstract = True
@@ -66,10 +71,27 @@ class Chat(Joinable):
     """
     group = models.ForeignKey(Group, related_name='chats',
                               blank=True, null=True)
+    last_message = models.ForeignKey('Message', related_name='+',
+                                     blank=True, null=True,
+                                     on_delete=models.SET_NULL)
+    last_activity_at = models.DateTimeField(blank=True, null=True,
+                                            db_index=True)
 
     class Meta:
         default_related_name = 'chats'
 
+    def record_message(self, message):
+        """Marks `message` as the last activity of the chat, and of
+        the inbox of each of its members, unless a more recent
+        message was already recorded by a concurrent request."""
+        date = message.date_sent
+        (Chat.objects.filter(models.Q(last_activity_at__lt=date) |
+                             models.Q(last_activity_at__isnull=True),
+                             pk=self.pk)
+                     .update(last_message=message, last_activity_at=date))
+        (InboxEntry.objects.filter(chat=self, last_activity_at__lt=date)
+                           .update(last_activity_at=date))
+
 
 class Message(models.Model):
     """Represents a message sent on the chat."""
@@ -80,6 +102,19 @@ class Message(models.Model):
     chat = models.ForeignKey(Chat, related_name='messages')
 
 
+class InboxEntry(models.Model):
+    """Denormalized entry of the list of chats of a user, so that
+    the chats can be listed by last activity from a single index.
+    There is one entry per member of a chat."""
+    user = models.ForeignKey(User, related_name='inbox')
+    chat = models.ForeignKey(Chat, related_name='inbox_entries')
+    last_activity_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'chat')
+        index_together = (('user', 'last_activity_at'),)
+
+
 class Invitation(models.Model):
     accepted = models.NullBooleanField(blank=True, null=True)
     created_on = models.DateTimeField(auto_now_add=True)
@@ -100,3 +135,55 @@ class GroupInvitation(Invitation):
 class ChatInvitation(Invitation):
     """Represents an invitation to a Chat."""
     chat = models.ForeignKey(Chat, related_name='invitations')
+
+
+class GroupAffinity(models.Model):
+    """Precomputed co-membership between two groups: `weight` is
+    the number of users that belong to both `group` and `other`.
+    See :mod:`core.recommendations`."""
+    group = models.ForeignKey(Group, related_name='affinities')
+    other = models.ForeignKey(Group, related_name='+')
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('group', 'other')
+
+
+class ChangeLogEntry(models.Model):
+    """Entry of the changelog from which clients sync incrementally.
+    Every change is fanned out to one entry per member of the entity,
+    which records that the entity was saved or removed, or that the
+    member joined or left it. The entries of a user are ordered by
+    their id, which clients use as their sync cursor."""
+    SAVED = 'saved'
+    REMOVED = 'removed'
+    JOINED = 'joined'
+    LEFT = 'left'
+    ACTIONS = ((SAVED, 'Saved'), (REMOVED, 'Removed'), (JOINED, 'Joined'),
+               (LEFT, 'Left'))
+
+    user = models.ForeignKey(User, related_name='+')
+    kind = models.CharField(max_length=20)
+    object_id = models.PositiveIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        index_together = (('user', 'id'),)
+
+
+class RetentionPolicy(models.Model):
+    """How long the messages and invitations of a community are
+    kept, in days. Empty fields fall back to `RETENTION_DEFAULTS`.
+    See :mod:`core.retention`."""
+    community = models.OneToOneField(Community,
+                                     related_name='retention_policy')
+    message_days = models.PositiveIntegerField(blank=True, null=True)
+    invitation_days = models.PositiveIntegerField(blank=True, null=True)
+
+
+class PurgeCheckpoint(models.Model):
+    """Last id processed by a purge job, so that an interrupted
+    purge resumes where it stopped."""
+    job = models.CharField(max_length=50, unique=True)
+    last_id = models.PositiveIntegerField(default=0)
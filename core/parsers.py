@@ -0,0 +1,36 @@
+"""
+Parsers for the formats of :mod:`core.renderers`.
+"""
+
+import msgpack
+import ujson
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from .renderers import UJSONRenderer, MessagePackRenderer
+
+
+class UJSONParser(JSONParser):
+    """Parses JSON with ujson."""
+    renderer_class = UJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return ujson.loads(stream.read().decode(encoding))
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % exc)
+
+
+class MessagePackParser(BaseParser):
+    """Parses MessagePack."""
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), encoding='utf-8')
+        except Exception as exc:
+            raise ParseError('MessagePack parse error - %s' % exc)
@@ -0,0 +1,125 @@
+"""
+Module that maintains the co-membership index used to suggest
+groups to the users.
+
+Two groups are related when they share members. For every pair of
+groups that share members, the number of shared members is stored
+in :class:`core.models.GroupAffinity`, so suggesting groups to a
+user is a single aggregation over the neighbours of the groups the
+user belongs to.
+
+Joins and leaves add or subtract one from the weights of the pairs
+they affect, instead of recomputing the neighbours of the groups.
+The index of the existing memberships is built with
+`python manage.py rebuildaffinity`.
+"""
+
+from collections import Counter
+from itertools import combinations
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from .models import Group, GroupAffinity
+from .tasks import task
+
+SUGGESTED_GROUPS_SIZE = 20
+
+
+def rebuild_group_affinity(group_id):
+    """Recomputes the neighbours of a group from its members."""
+    through = Group.users.through
+    members = through.objects.filter(group=group_id).values('user')
+    neighbours = (through.objects
+                  .filter(user__in=members)
+                  .exclude(group=group_id)
+                  .values('group')
+                  .annotate(weight=Count('user')))
+    with transaction.atomic():
+        GroupAffinity.objects.filter(group_id=group_id).delete()
+        if not Group.objects.filter(pk=group_id).exists():
+            return
+        GroupAffinity.objects.bulk_create([
+            GroupAffinity(group_id=group_id, other_id=n['group'],
+                          weight=n['weight'])
+            for n in neighbours])
+
+
+def affinity_pairs(user_ids, group_ids):
+    """Returns the pairs of groups whose weight changes when the
+    users join or leave the groups, with how much it changes, as
+    `[group, other, count]` lists.
+
+    Must be called after the membership changed: the other groups of
+    the users are the groups they still belong to."""
+    changed = set(group_ids)
+    pairs = Counter()
+    others = (Group.users.through.objects
+              .filter(user__in=user_ids)
+              .exclude(group__in=changed)
+              .values_list('group', flat=True))
+    for other in others:
+        for group_id in changed:
+            pairs[group_id, other] += 1
+    for pair in combinations(sorted(changed), 2):
+        pairs[pair] += len(user_ids)
+    return [[group, other, count]
+            for (group, other), count in pairs.items()]
+
+
+@task
+def update_affinity_weights(pairs, delta):
+    """Adds `delta` times the count of every pair to the weights of
+    the pair in both directions, and drops the pairs that no longer
+    share members.
+
+    :param pairs: The pairs returned by :func:`affinity_pairs`.
+    :param delta: 1 if the users joined the groups, -1 if they left.
+    """
+    ids = set(pk for group, other, _ in pairs for pk in (group, other))
+    existing = set(Group.objects.filter(pk__in=ids)
+                                .values_list('pk', flat=True))
+    with transaction.atomic():
+        for group, other, count in pairs:
+            if group not in existing or other not in existing:
+                continue
+            for a, b in ((group, other), (other, group)):
+                add_weight(a, b, delta * count)
+        GroupAffinity.objects.filter(group__in=ids, weight__lte=0).delete()
+
+
+def add_weight(group_id, other_id, weight):
+    affinity = GroupAffinity.objects.filter(group_id=group_id,
+                                            other_id=other_id)
+    if affinity.update(weight=F('weight') + weight) or weight <= 0:
+        return
+    try:
+        with transaction.atomic():
+            GroupAffinity.objects.create(group_id=group_id,
+                                         other_id=other_id, weight=weight)
+    except IntegrityError:
+        # Created by a concurrent task since the update.
+        affinity.update(weight=F('weight') + weight)
+
+
+def schedule_affinity(user_ids, group_ids, delta):
+    """Enqueues the update of the index after the users joined
+    (`delta` 1) or left (`delta` -1) the groups."""
+    pairs = affinity_pairs(user_ids, group_ids)
+    if pairs:
+        update_affinity_weights.enqueue(pairs, delta)
+
+
+def suggested_groups(user, limit=SUGGESTED_GROUPS_SIZE):
+    """Returns the groups that share the most members with the groups
+    of `user`, excluding the ones the user already belongs to."""
+    groups = Group.objects.filter(users=user).values('pk')
+    scores = (GroupAffinity.objects
+              .filter(group__in=groups)
+              .exclude(other__in=groups)
+              .values('other')
+              .annotate(score=Sum('weight'))
+              .order_by('-score')[:limit])
+    ids = [s['other'] for s in scores]
+    bulk = Group.objects.in_bulk(ids)
+    return [bulk[pk] for pk in ids if pk in bulk]
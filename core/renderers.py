@@ -0,0 +1,66 @@
+"""
+Renderers that are faster to encode than the default JSON renderer
+of REST framework.
+"""
+
+import msgpack
+import ujson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def native_serializer_output():
+    """Whether the serializer fields output only JSON-native types,
+    which is the case while dates are formatted and decimals are
+    coerced to strings, as they are by default."""
+    return (api_settings.COERCE_DECIMAL_TO_STRING and
+            api_settings.DATETIME_FORMAT is not None and
+            api_settings.DATE_FORMAT is not None and
+            api_settings.TIME_FORMAT is not None)
+
+
+class UJSONRenderer(JSONRenderer):
+    """Renders JSON with ujson.
+
+    ujson has no hook for the types that JSON lacks, and it encodes
+    some of them wrongly instead of failing: dates become timestamps,
+    decimals floats and other objects empty objects. The data must
+    therefore be serializer output, or hold only JSON-native types.
+    Checking every value would cost more than the encoding saves, so
+    the default renderer is only used when the serializer settings
+    allow other types, for indented output, which is requested by the
+    browsable API, and when ujson fails."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        renderer_context = renderer_context or {}
+        if (self.get_indent(accepted_media_type,
+                            renderer_context) is not None or
+                not native_serializer_output()):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            ret = ujson.dumps(data, ensure_ascii=self.ensure_ascii,
+                              escape_forward_slashes=False)
+        except (TypeError, ValueError, OverflowError, UnicodeDecodeError):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        ret = ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+        return ret.encode('utf-8')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renders MessagePack, a binary format that is smaller and
+    faster to encode and decode than JSON."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        return msgpack.packb(data, use_bin_type=True,
+                             default=JSONEncoder().default)
@@ -0,0 +1,149 @@
+"""
+Module that purges the messages, read receipts and invitations that
+are older than the retention of their community, and the sync
+changelog entries older than `SYNC_CHANGELOG_DAYS`.
+
+Rows are scanned in primary key order and deleted in bounded
+batches, with a pause between batches so that the purge does not
+hold locks on the tables for long. The last id processed is saved
+in a :class:`core.models.PurgeCheckpoint` after every batch.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import (Chat, Message, GroupInvitation, ChatInvitation,
+                     RetentionPolicy, PurgeCheckpoint, ChangeLogEntry)
+
+
+class PurgeJob(object):
+    """Purge of the rows of `model` whose `date_field` is older than
+    the retention in `days_field` of the community they belong to,
+    reached through `community_path`."""
+
+    def __init__(self, name, model, date_field, community_path,
+                 days_field):
+        self.name = name
+        self.model = model
+        self.date_field = date_field
+        self.community_path = community_path
+        self.days_field = days_field
+
+    def cutoffs(self, now):
+        """Returns the default cutoff date and the cutoff dates of the
+        communities with their own retention."""
+        def cutoff(days):
+            return None if days is None else now - timedelta(days=days)
+        policies = (RetentionPolicy.objects
+                    .filter(**{self.days_field + '__isnull': False})
+                    .values_list('community', self.days_field))
+        default = settings.RETENTION_DEFAULTS[self.days_field]
+        return cutoff(default), {c: cutoff(d) for c, d in policies}
+
+    def delete(self, ids):
+        """Deletes the rows with the given ids and returns the
+        number of rows deleted."""
+        self.model.objects.filter(pk__in=ids).delete()
+        return len(ids)
+
+    def run(self, batch_size, sleep, now=None):
+        """Purges the expired rows. Yields, after every batch, the
+        number of rows scanned and deleted."""
+        default, communities = self.cutoffs(now or timezone.now())
+        cutoffs = [c for c in [default] + list(communities.values())
+                   if c is not None]
+        if not cutoffs:
+            return
+        checkpoint, _ = PurgeCheckpoint.objects.get_or_create(job=self.name)
+        fields = ['pk', self.date_field]
+        if self.community_path is not None:
+            fields.append(self.community_path)
+        rows = (self.model.objects
+                .filter(**{self.date_field + '__lt': max(cutoffs)})
+                .order_by('pk')
+                .values_list(*fields))
+        while True:
+            batch = list(
+                rows.filter(pk__gt=checkpoint.last_id)[:batch_size])
+            if not batch:
+                break
+            ids = []
+            for row in batch:
+                pk, date = row[:2]
+                community = row[2] if len(row) > 2 else None
+                cutoff = communities.get(community, default)
+                if cutoff is not None and date < cutoff:
+                    ids.append(pk)
+            with transaction.atomic():
+                deleted = self.delete(ids) if ids else 0
+                checkpoint.last_id = batch[-1][0]
+                checkpoint.save(update_fields=['last_id'])
+            yield len(batch), deleted
+            time.sleep(sleep)
+        checkpoint.last_id = 0
+        checkpoint.save(update_fields=['last_id'])
+
+
+class MessagePurgeJob(PurgeJob):
+    """Purge of messages, along with their read receipts.
+
+    Deleting messages through the ORM would load every message of the
+    batch to set `Chat.last_message` to NULL and send the delete
+    signals. The references are cleared with one update, the removals
+    are logged for the members of the chats and the messages are
+    deleted with a single statement instead."""
+
+    def delete(self, ids):
+        Chat.objects.filter(last_message__in=ids).update(last_message=None)
+        self.log_removed(ids)
+        receipts = Message.seen_by.through.objects.filter(message__in=ids)
+        count = receipts.count()
+        receipts.delete()
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE id IN (%s)' % (
+                connection.ops.quote_name(Message._meta.db_table),
+                ', '.join(['%s'] * len(ids))), ids)
+            return count + cursor.rowcount
+
+    def log_removed(self, ids):
+        """Writes the `removed` changelog entries of the messages for
+        the members of their chats."""
+        messages = (Message.objects.filter(pk__in=ids)
+                                   .values_list('pk', 'chat'))
+        members = {}
+        for chat, user in (Chat.users.through.objects
+                           .filter(chat__messages__in=ids)
+                           .values_list('chat', 'user').distinct()):
+            members.setdefault(chat, []).append(user)
+        ChangeLogEntry.objects.bulk_create(
+            ChangeLogEntry(user_id=user, kind='message', object_id=pk,
+                           action=ChangeLogEntry.REMOVED)
+            for pk, chat in messages for user in members.get(chat, ()))
+
+
+class ChangeLogPurgeJob(PurgeJob):
+    """Purge of the sync changelog. The entries do not belong to a
+    community, so they are kept for `SYNC_CHANGELOG_DAYS`. Clients
+    whose cursor was purged get a new snapshot on their next sync."""
+
+    def __init__(self):
+        super().__init__('changelog', ChangeLogEntry, 'created_on', None,
+                         None)
+
+    def cutoffs(self, now):
+        return now - timedelta(days=settings.SYNC_CHANGELOG_DAYS), {}
+
+
+JOBS = (
+    MessagePurgeJob('messages', Message, 'date_sent',
+                    'chat__group__community', 'message_days'),
+    PurgeJob('groupinvitations', GroupInvitation, 'created_on',
+             'group__community', 'invitation_days'),
+    PurgeJob('chatinvitations', ChatInvitation, 'created_on',
+             'chat__group__community', 'invitation_days'),
+    ChangeLogPurgeJob(),
+)
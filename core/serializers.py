@@ -1,12 +1,45 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 
+from .images import thumbnail_name
 from .models import (Community, Group, Chat, Message,
                      GroupInvitation, ChatInvitation,
                      User)
 
 
+class ThumbnailsField(serializers.Field):
+    """Read only field that holds the URLs of the thumbnails of
+    a picture, by variant. Until the thumbnails are generated,
+    every variant points to the original picture."""
+
+    def __init__(self, picture_field, **kwargs):
+        self.picture_field = picture_field
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        picture = getattr(instance, self.picture_field)
+        if not picture:
+            return None
+        digest = getattr(instance, self.picture_field + '_hash')
+        request = self.context.get('request', None)
+        urls = {}
+        for variant in settings.THUMBNAIL_SIZES:
+            if digest:
+                url = default_storage.url(thumbnail_name(digest, variant))
+            else:
+                url = picture.url
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[variant] = url
+        return urls
+
+
 class UserSerializer(serializers.HyperlinkedModelSerializer):
     """Represents the serialization of the user."""
+    profile_picture_thumbnails = ThumbnailsField('profile_picture')
     communities = (serializers
                    .HyperlinkedRelatedField(many=True,
                                             view_name='community-detail',
@@ -30,12 +63,14 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = User
-        fields = ('url', 'profile_picture', 'chats', 'username', 'last_login',
-                  'communities', 'c_groups', 'seen_messages', 'sent_messages')
+        fields = ('url', 'profile_picture', 'profile_picture_thumbnails',
+                  'chats', 'username', 'last_login', 'communities',
+                  'c_groups', 'seen_messages', 'sent_messages')
         read_only_fields = ('profile_picture', )
 
 
 class JoinableSerializer(serializers.HyperlinkedModelSerializer):
+    picture_thumbnails = ThumbnailsField('picture')
     users = serializers.HyperlinkedRelatedField(many=True,
                                                 read_only=True,
                                                 view_name='user-detail')
@@ -46,7 +81,8 @@ class CommunitySerializer(JoinableSerializer):
 
     class Meta:
         model = Community
-        fields = ('url', 'picture', 'name', 'created_on', 'users')
+        fields = ('url', 'picture', 'picture_thumbnails', 'name',
+                  'created_on', 'users')
         read_only_fields = ('picture', )
 
 
@@ -59,8 +95,8 @@ class GroupSerializer(JoinableSerializer):
 
     class Meta:
         model = Group
-        fields = ('url', 'picture', 'name', 'created_on', 'users',
-                  'community')
+        fields = ('url', 'picture', 'picture_thumbnails', 'name',
+                  'created_on', 'users', 'community')
         read_only_fields = ('picture', )
 
 
@@ -71,12 +107,16 @@ class ChatSerializer(JoinableSerializer):
                                                    view_name='message-detail')
     group = serializers.HyperlinkedRelatedField(queryset=Group.objects.all(),
                                                 view_name='group-detail')
+    last_message = (serializers
+                    .HyperlinkedRelatedField(read_only=True,
+                                             view_name='message-detail'))
 
     class Meta:
         model = Chat
-        fields = ('url', 'picture', 'name', 'created_on',
-                  'users', 'messages', 'group')
-        read_only_fields = ('picture', )
+        fields = ('url', 'picture', 'picture_thumbnails', 'name',
+                  'created_on', 'users', 'messages', 'group',
+                  'last_message', 'last_activity_at')
+        read_only_fields = ('picture', 'last_activity_at')
 
 
 class MessageSerializer(serializers.HyperlinkedModelSerializer):
@@ -96,6 +136,57 @@ class MessageSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('url', 'content', 'date_sent', 'sender', 'seen_by', 'chat')
 
 
+class CommunitySummarySerializer(serializers.HyperlinkedModelSerializer):
+    """Serializer for a community without its members, for listings
+    whose size must not grow with the size of the entities."""
+    picture_thumbnails = ThumbnailsField('picture')
+
+    class Meta:
+        model = Community
+        fields = ('url', 'picture', 'picture_thumbnails', 'name',
+                  'created_on')
+
+
+class GroupSummarySerializer(serializers.HyperlinkedModelSerializer):
+    """Serializer for a group without its members."""
+    picture_thumbnails = ThumbnailsField('picture')
+    community = (serializers
+                 .HyperlinkedRelatedField(read_only=True,
+                                          view_name='community-detail'))
+
+    class Meta:
+        model = Group
+        fields = ('url', 'picture', 'picture_thumbnails', 'name',
+                  'created_on', 'community')
+
+
+class ChatSummarySerializer(serializers.HyperlinkedModelSerializer):
+    """Serializer for a chat without its members and messages."""
+    picture_thumbnails = ThumbnailsField('picture')
+    group = serializers.HyperlinkedRelatedField(read_only=True,
+                                                view_name='group-detail')
+    last_message = (serializers
+                    .HyperlinkedRelatedField(read_only=True,
+                                             view_name='message-detail'))
+
+    class Meta:
+        model = Chat
+        fields = ('url', 'picture', 'picture_thumbnails', 'name',
+                  'created_on', 'group', 'last_message', 'last_activity_at')
+
+
+class MessageSummarySerializer(serializers.HyperlinkedModelSerializer):
+    """Serializer for a message without its read receipts."""
+    chat = serializers.HyperlinkedRelatedField(read_only=True,
+                                               view_name='chat-detail')
+    sender = serializers.HyperlinkedRelatedField(read_only=True,
+                                                 view_name='user-detail')
+
+    class Meta:
+        model = Message
+        fields = ('url', 'content', 'date_sent', 'sender', 'chat')
+
+
 class InvitationSeralizer(serializers.HyperlinkedModelSerializer):
     """Serializer for an invitation"""
     inviter = (serializers
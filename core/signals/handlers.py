@@ -2,11 +2,16 @@
 Module that defines the signal handlers for the application.
 """
 
-from django.db.models.signals import (post_save, m2m_changed)
+from django.db.models.signals import (post_init, post_save, pre_delete,
+                                      m2m_changed)
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
-from core.models import Group, User
+from core.images import schedule_thumbnails
+from core.models import (Community, Group, Chat, Message, User,
+                         ChangeLogEntry, InboxEntry)
+from core.recommendations import schedule_affinity
+from core.tasks import task
 
 
 @receiver(post_save, sender=User)
@@ -15,14 +20,222 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
         Token.objects.create(user=instance)
 
 
+def picture_name(instance, field):
+    """Returns the name of the picture in `field` without building
+    the file object of the field."""
+    value = instance.__dict__.get(field)
+    return getattr(value, 'name', value)
+
+
+@receiver(post_init, sender=User)
+def remember_profile_picture(sender, instance=None, **kwargs):
+    instance._saved_profile_picture = picture_name(instance,
+                                                   'profile_picture')
+
+
+@receiver(post_init, sender=Community)
+@receiver(post_init, sender=Group)
+@receiver(post_init, sender=Chat)
+def remember_picture(sender, instance=None, **kwargs):
+    instance._saved_picture = picture_name(instance, 'picture')
+
+
+def picture_changed(instance, field, update_fields):
+    """Whether the picture stored in `field` changed since the
+    instance was loaded or last saved, and needs new thumbnails.
+    The saved name is updated, so that saving the instance again
+    does not process the picture again."""
+    if update_fields is not None and field not in update_fields:
+        return False
+    name = picture_name(instance, field)
+    attr = '_saved_' + field
+    changed = getattr(instance, attr, None) != name
+    setattr(instance, attr, name)
+    default = instance._meta.get_field(field).default
+    return changed and bool(name) and name != default
+
+
+@receiver(post_save, sender=User)
+def create_profile_picture_thumbnails(sender, instance=None,
+                                      update_fields=None, **kwargs):
+    if picture_changed(instance, 'profile_picture', update_fields):
+        schedule_thumbnails(instance, 'profile_picture')
+
+
+@receiver(post_save, sender=Community)
+@receiver(post_save, sender=Group)
+@receiver(post_save, sender=Chat)
+def create_picture_thumbnails(sender, instance=None,
+                              update_fields=None, **kwargs):
+    if picture_changed(instance, 'picture', update_fields):
+        schedule_thumbnails(instance, 'picture')
+
+
+def group_key(group_id):
+    return 'group-active:%d' % group_id
+
+
+@task(key=group_key)
+def update_group_active(group_id):
+    """Activates the group if it has enough members and deletes it
+    if it has none."""
+    count = Group.users.through.objects.filter(group=group_id).count()
+    if count == 0:
+        Group.objects.filter(pk=group_id).delete()
+    else:
+        Group.objects.filter(pk=group_id).update(is_active=count >= 3)
+
+
 @receiver(m2m_changed, sender=Group.users.through)
 def check_group_active(sender, instance=None, action='',
-                       reverse=False, **kwargs):
-    if action.startswith('post') and not reverse:
-        if instance.users.count() >= 3:
-            instance.active = True
+                       reverse=False, pk_set=None, **kwargs):
+    if not action.startswith('post'):
+        return
+    if not reverse:
+        update_group_active.enqueue(instance.pk)
+    elif pk_set:
+        for group_id in pk_set:
+            update_group_active.enqueue(group_id)
+
+
+@receiver(m2m_changed, sender=Group.users.through)
+def update_group_affinity(sender, instance=None, action='', reverse=False,
+                          pk_set=None, **kwargs):
+    # The memberships that are removed are recorded before they are
+    # deleted, since `pk_set` may hold objects that were not related.
+    if action in ('pre_clear', 'pre_remove'):
+        related = instance.c_groups if reverse else instance.users
+        if action == 'pre_remove':
+            related = related.filter(pk__in=pk_set)
+        instance._removed_pks = list(related.values_list('pk', flat=True))
+        return
+    if action in ('post_clear', 'post_remove'):
+        pk_set, delta = instance.__dict__.pop('_removed_pks', []), -1
+    elif action == 'post_add':
+        delta = 1
+    else:
+        return
+    if not pk_set:
+        return
+    if reverse:
+        schedule_affinity([instance.pk], pk_set, delta)
+    else:
+        schedule_affinity(pk_set, [instance.pk], delta)
+
+
+JOINABLES = {'community': Community, 'group': Group, 'chat': Chat}
+
+
+def members_of(kind, object_id):
+    """Returns the ids of the users that can see an entity."""
+    if kind == 'message':
+        chats = Message.objects.filter(pk=object_id).values('chat')
+        through = Chat.users.through.objects.filter(chat__in=chats)
+    else:
+        through = JOINABLES[kind].users.through.objects.filter(
+            **{kind: object_id})
+    return through.values_list('user', flat=True)
+
+
+def changelog_key(kind, object_id, action=ChangeLogEntry.SAVED, changed=(),
+                  members=None):
+    # A save that is waiting in the queue logs the later saves too.
+    if action == ChangeLogEntry.SAVED:
+        return 'changelog:%s:%d' % (kind, object_id)
+    return None
+
+
+@task(key=changelog_key)
+def log_changes(kind, object_id, action=ChangeLogEntry.SAVED, changed=(),
+                members=None):
+    """Writes the changelog entries of an entity: `action` for the
+    users in `changed`, and `saved` for the rest of `members`. The
+    members are read when the task runs unless they are given, as
+    they are for the entities that are removed."""
+    if members is None:
+        members = members_of(kind, object_id)
+    changed = set(changed)
+    ChangeLogEntry.objects.bulk_create(
+        ChangeLogEntry(user_id=user_id, kind=kind, object_id=object_id,
+                       action=action if user_id in changed else
+                       ChangeLogEntry.SAVED)
+        for user_id in set(members) | changed)
+
+
+@receiver(post_save, sender=Community)
+@receiver(post_save, sender=Group)
+@receiver(post_save, sender=Chat)
+@receiver(post_save, sender=Message)
+def log_saved(sender, instance=None, **kwargs):
+    log_changes.enqueue(sender._meta.model_name, instance.pk)
+
+
+@receiver(pre_delete, sender=Community)
+@receiver(pre_delete, sender=Group)
+@receiver(pre_delete, sender=Chat)
+@receiver(pre_delete, sender=Message)
+def log_removed(sender, instance=None, **kwargs):
+    kind = sender._meta.model_name
+    members = list(members_of(kind, instance.pk))
+    if members:
+        log_changes.enqueue(kind, instance.pk, ChangeLogEntry.REMOVED,
+                            members, [])
+
+
+@receiver(m2m_changed, sender=Community.users.through)
+@receiver(m2m_changed, sender=Group.users.through)
+@receiver(m2m_changed, sender=Chat.users.through)
+def log_membership(sender, instance=None, action='', reverse=False,
+                   model=None, pk_set=None, **kwargs):
+    if action == 'pre_clear':
+        if reverse:
+            related = model._default_manager.filter(users=instance)
         else:
-            instance.active = False
+            related = instance.users.all()
+        instance._cleared_members = list(related.values_list('pk',
+                                                             flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_members', [])
+        action = ChangeLogEntry.LEFT
+    elif action == 'post_add':
+        action = ChangeLogEntry.JOINED
+    elif action == 'post_remove':
+        action = ChangeLogEntry.LEFT
+    else:
+        return
+    if reverse:
+        kind = model._meta.model_name
+        for object_id in pk_set:
+            log_changes.enqueue(kind, object_id, action, [instance.pk])
+    elif pk_set:
+        log_changes.enqueue(instance._meta.model_name, instance.pk, action,
+                            sorted(pk_set))
+
 
-        if instance.users.count() == 0:
-            instance.delete()
+@receiver(m2m_changed, sender=Chat.users.through)
+def update_inbox(sender, instance=None, action='', reverse=False,
+                 pk_set=None, **kwargs):
+    if action == 'post_clear':
+        lookup = 'user' if reverse else 'chat'
+        InboxEntry.objects.filter(**{lookup: instance}).delete()
+        return
+    if action not in ('post_add', 'post_remove'):
+        return
+    if reverse:
+        entries = InboxEntry.objects.filter(user=instance, chat__in=pk_set)
+        pairs = [(instance.pk, pk) for pk in pk_set]
+    else:
+        entries = InboxEntry.objects.filter(chat=instance, user__in=pk_set)
+        pairs = [(pk, instance.pk) for pk in pk_set]
+    if action == 'post_remove':
+        entries.delete()
+        return
+    existing = set(entries.values_list('user', 'chat'))
+    chats = {c.pk: c for c in Chat.objects.filter(
+        pk__in=[chat for _, chat in pairs])}
+    InboxEntry.objects.bulk_create(
+        InboxEntry(user_id=user, chat_id=chat,
+                   last_activity_at=(chats[chat].last_activity_at or
+                                     chats[chat].created_on))
+        for user, chat in pairs if (user, chat) not in existing)
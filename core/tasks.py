@@ -0,0 +1,275 @@
+"""
+Module that defines a lightweight task queue used to take side
+effects out of the request/response cycle.
+
+Tasks are plain functions registered with the :func:`task`
+decorator. They are enqueued with JSON serializable arguments
+and executed by the backend configured in `TASK_QUEUE`:
+
+* :class:`ThreadPoolBackend` runs the tasks in a pool of threads
+  of the same process. It is meant for tests and single node
+  deployments.
+* :class:`RedisBackend` pushes the tasks to a Redis list that is
+  consumed by `python manage.py runtasks`.
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import FieldError
+from django.core.signals import setting_changed
+from django.db import close_old_connections, connection, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .db import pin_primary
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+# Errors of the code of the task rather than of the resources it uses.
+# Retrying them is pointless, and they must not be hidden in the logs
+# of the retries.
+PROGRAMMING_ERRORS = (AttributeError, FieldError, ImportError, NameError,
+                      TypeError)
+
+_queue = None
+
+
+class Task(object):
+    """A function that can be executed by the task queue.
+
+    :param func: The function to execute.
+    :param key: Function that returns an idempotency key from the
+                arguments of the task. While a task with the same
+                key is waiting in the queue, new ones are dropped.
+    :param max_retries: How many times the task is retried when
+                        it raises an exception.
+    :param retry_delay: Seconds to wait before the first retry. The
+                        delay doubles on every retry.
+    """
+
+    def __init__(self, func, key=None, max_retries=3, retry_delay=1):
+        self.func = func
+        self.name = '%s.%s' % (func.__module__, func.__name__)
+        self.key = key
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+    def __call__(self, *args):
+        return self.func(*args)
+
+    def enqueue(self, *args):
+        """Enqueues the task once the current transaction, if any,
+        is committed."""
+        key = self.key(*args) if self.key is not None else None
+        envelope = {
+            'task': self.name,
+            'args': list(args),
+            'key': key,
+            'attempts': 0,
+        }
+        on_commit(lambda: get_queue().push(envelope))
+
+
+def task(func=None, **options):
+    """Decorator that registers a function as a :class:`Task`."""
+    def decorator(func):
+        t = Task(func, **options)
+        registry[t.name] = t
+        return t
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+def on_commit(func):
+    """Runs `func` after the current transaction is committed.
+
+    Django 1.8 has no commit hooks. Requests are not atomic in this
+    project, so writes are already committed when the handlers run
+    and `func` is called right away. Newer versions of Django defer
+    it with `transaction.on_commit`.
+    """
+    hook = getattr(transaction, 'on_commit', None)
+    if hook is not None:
+        hook(func)
+    else:
+        func()
+
+
+def execute(envelope, retry):
+    """Executes the task described by `envelope`. If it fails and it
+    can still be retried, `retry` is called with the new envelope and
+    the delay in seconds. Programming errors are not retried but
+    raised, and tasks that are not registered are dropped."""
+    t = registry.get(envelope['task'])
+    if t is None:
+        logger.error('Unknown task %s dropped', envelope['task'])
+        return
+    try:
+        with pin_primary():
+            t.func(*envelope['args'])
+    except PROGRAMMING_ERRORS:
+        logger.exception('Task %s is broken', t.name)
+        raise
+    except Exception:
+        attempts = envelope['attempts']
+        if attempts >= t.max_retries:
+            logger.exception('Task %s failed after %d attempts',
+                             t.name, attempts + 1)
+            return
+        logger.warning('Task %s failed, retrying', t.name, exc_info=True)
+        retry(dict(envelope, attempts=attempts + 1),
+              t.retry_delay * 2 ** attempts)
+
+
+class ThreadPoolBackend(object):
+    """Executes the tasks in a pool of threads of the current process.
+
+    :param workers: Number of threads in the pool.
+    :param eager: If True, tasks are executed right away in the
+                  thread that enqueues them. Useful for tests.
+    """
+
+    def __init__(self, workers=4, eager=False):
+        self.eager = eager
+        self.executor = None if eager else ThreadPoolExecutor(workers)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.counter = 0
+
+    def push(self, envelope):
+        if self.eager:
+            execute(envelope, lambda env, delay: self.push(env))
+            return
+        with self.lock:
+            key = envelope['key']
+            if key is not None and key in self.pending:
+                return
+            if key is None:
+                self.counter += 1
+                key = ('anonymous', self.counter)
+            self.pending[key] = time.time()
+        self.executor.submit(self.run, key, envelope)
+
+    def run(self, key, envelope):
+        with self.lock:
+            self.pending.pop(key, None)
+        try:
+            execute(envelope, self.retry)
+        finally:
+            connection.close()
+
+    def retry(self, envelope, delay):
+        timer = threading.Timer(delay, self.push, (envelope,))
+        timer.daemon = True
+        timer.start()
+
+    def depth(self):
+        """Number of tasks waiting to be executed."""
+        return len(self.pending)
+
+    def lag(self):
+        """Seconds that the oldest waiting task has been queued."""
+        with self.lock:
+            if not self.pending:
+                return 0.0
+            return time.time() - min(self.pending.values())
+
+
+class RedisBackend(object):
+    """Pushes the tasks to a Redis list that is consumed by
+    :meth:`work`.
+
+    :param url: URL of the Redis server.
+    :param name: Prefix of the keys used in Redis.
+    :param key_timeout: Seconds after which an idempotency key
+                        expires, in case its task is lost.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', name='tasks',
+                 key_timeout=3600):
+        import redis
+        self.redis = redis.StrictRedis.from_url(url)
+        self.name = name
+        self.delayed = name + ':delayed'
+        self.key_timeout = key_timeout
+
+    def push(self, envelope):
+        key = envelope['key']
+        if key is not None and envelope['attempts'] == 0:
+            if not self.redis.set('%s:key:%s' % (self.name, key), 1,
+                                  nx=True, ex=self.key_timeout):
+                return
+        envelope = dict(envelope, enqueued_at=time.time())
+        self.redis.lpush(self.name, json.dumps(envelope))
+
+    def retry(self, envelope, delay):
+        self.redis.zadd(self.delayed, time.time() + delay,
+                        json.dumps(envelope))
+
+    def promote_delayed(self):
+        """Moves the retries that are due to the queue."""
+        now = time.time()
+        for raw in self.redis.zrangebyscore(self.delayed, 0, now):
+            if self.redis.zrem(self.delayed, raw):
+                self.push(json.loads(raw.decode('utf-8')))
+
+    def work(self, timeout=1):
+        """Consumes tasks until interrupted. Tasks that raise
+        programming errors are kept in the `<name>:failed` list and
+        stop the worker."""
+        while True:
+            self.promote_delayed()
+            item = self.redis.brpop(self.name, timeout=timeout)
+            if item is None:
+                continue
+            envelope = json.loads(item[1].decode('utf-8'))
+            if envelope['key'] is not None:
+                self.redis.delete('%s:key:%s' % (self.name,
+                                                 envelope['key']))
+            # Drops the connections that the database closed, e.g.
+            # after a restart, as Django does around every request.
+            close_old_connections()
+            try:
+                execute(envelope, self.retry)
+            except PROGRAMMING_ERRORS:
+                self.redis.lpush(self.name + ':failed', item[1])
+                raise
+            finally:
+                close_old_connections()
+
+    def depth(self):
+        """Number of tasks waiting to be executed."""
+        return self.redis.llen(self.name)
+
+    def lag(self):
+        """Seconds that the oldest waiting task has been queued."""
+        oldest = self.redis.lindex(self.name, -1)
+        if oldest is None:
+            return 0.0
+        return time.time() - json.loads(oldest.decode('utf-8'))[
+            'enqueued_at']
+
+
+def get_queue():
+    """Returns the backend configured in `TASK_QUEUE`."""
+    global _queue
+    if _queue is None:
+        config = settings.TASK_QUEUE
+        backend = import_string(config['BACKEND'])
+        _queue = backend(**config.get('OPTIONS', {}))
+    return _queue
+
+
+@receiver(setting_changed)
+def reset_queue(setting, **kwargs):
+    global _queue
+    if setting == 'TASK_QUEUE':
+        _queue = None
@@ -0,0 +1,159 @@
+"""
+Test runner that runs the test cases in several processes, each
+one with its own test database, and reports the slowest tests.
+"""
+
+import multiprocessing
+import os
+import time
+import unittest
+from io import StringIO
+
+from django.db import connections
+from django.test.runner import DebugSQLTextTestResult, DiscoverRunner
+
+_runner = None
+_buckets = None
+
+
+class TimingTestResult(unittest.TextTestResult):
+    """Test result that records how long every test takes."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timings = []
+
+    def startTest(self, test):
+        self._started = time.time()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        super().stopTest(test)
+        self.timings.append((test.id(), time.time() - self._started))
+
+
+class DebugSQLTimingTestResult(TimingTestResult, DebugSQLTextTestResult):
+    """Test result that records how long every test takes, and prints
+    the SQL queries of the tests that fail (`--debug-sql`)."""
+
+
+def flatten(suite):
+    """Yields the tests of a suite, in order."""
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from flatten(test)
+        else:
+            yield test
+
+
+def partition(suite, count):
+    """Splits the tests of a suite in at most `count` suites with
+    about the same number of tests. The tests of a class stay in
+    the same suite, so that their class fixtures are built once."""
+    classes = {}
+    for test in flatten(suite):
+        classes.setdefault(test.__class__, []).append(test)
+    buckets = [[] for _ in range(min(count, len(classes)))]
+    for tests in sorted(classes.values(), key=len, reverse=True):
+        min(buckets, key=len).extend(tests)
+    return [unittest.TestSuite(tests) for tests in buckets]
+
+
+def run_bucket(worker):
+    """Runs a bucket of tests in a worker process, on test databases
+    of its own. Returns a summary that can be sent to the parent."""
+    for alias in connections:
+        connection = connections[alias]
+        test_settings = connection.settings_dict['TEST']
+        name = connection.creation._get_test_db_name()
+        if test_settings.get('MIRROR') or 'memory' in name:
+            continue
+        test_settings['NAME'] = '%s_%d' % (name, worker)
+
+    stream = StringIO()
+    old_config = _runner.setup_databases()
+    try:
+        result = _runner.run_suite(_buckets[worker], stream=stream)
+    finally:
+        _runner.teardown_databases(old_config)
+    return {
+        'output': stream.getvalue(),
+        'tests_run': result.testsRun,
+        'failures': len(result.failures),
+        'errors': len(result.errors),
+        'timings': result.timings,
+    }
+
+
+class ParallelTestRunner(DiscoverRunner):
+    """Runs the test cases in `--parallel` processes and prints the
+    `--slowest` tests at the end."""
+
+    def __init__(self, parallel=None, slowest=10, **kwargs):
+        super().__init__(**kwargs)
+        self.parallel = parallel or os.cpu_count() or 1
+        self.slowest = slowest
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--parallel', type=int, dest='parallel',
+                            help='Number of processes. Defaults to the '
+                                 'number of CPUs.')
+        parser.add_argument('--slowest', type=int, dest='slowest',
+                            default=10,
+                            help='Number of slowest tests to report.')
+
+    def get_resultclass(self):
+        if self.debug_sql:
+            return DebugSQLTimingTestResult
+        return TimingTestResult
+
+    def run_suite(self, suite, stream=None, **kwargs):
+        return unittest.TextTestRunner(
+            stream=stream, verbosity=self.verbosity,
+            failfast=self.failfast,
+            resultclass=self.get_resultclass()).run(suite)
+
+    def run_tests(self, test_labels, extra_tests=None, **kwargs):
+        global _runner, _buckets
+        self.setup_test_environment()
+        suite = self.build_suite(test_labels, extra_tests)
+        start = time.time()
+        buckets = partition(suite, self.parallel)
+        if len(buckets) <= 1:
+            old_config = self.setup_databases()
+            result = self.run_suite(suite)
+            self.teardown_databases(old_config)
+            summaries = [{'output': '', 'tests_run': result.testsRun,
+                          'failures': len(result.failures),
+                          'errors': len(result.errors),
+                          'timings': result.timings}]
+        else:
+            _runner, _buckets = self, buckets
+            # The workers are forked, so that they inherit the suite,
+            # and they must not share the connections of the parent.
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(len(buckets))
+            try:
+                summaries = pool.map(run_bucket, range(len(buckets)))
+            finally:
+                pool.close()
+                pool.join()
+            for summary in summaries:
+                print(summary['output'], end='')
+            print('Ran %d tests in %d processes in %.3fs' %
+                  (sum(s['tests_run'] for s in summaries), len(buckets),
+                   time.time() - start))
+        self.teardown_test_environment()
+        self.report_slowest(summaries)
+        return sum(s['failures'] + s['errors'] for s in summaries)
+
+    def report_slowest(self, summaries):
+        timings = sorted((t for s in summaries for t in s['timings']),
+                         key=lambda t: t[1], reverse=True)
+        if not self.slowest or not timings:
+            return
+        print('\nSlowest %d tests:' % min(self.slowest, len(timings)))
+        for test_id, seconds in timings[:self.slowest]:
+            print('%8.3fs  %s' % (seconds, test_id))
@@ -1,27 +1,86 @@
+import csv
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+import msgpack
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.test import (override_settings, RequestFactory,
+                         SimpleTestCase)
+from django.utils import timezone
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 from rest_framework import status
 
+from core.db import is_pinned, pin_primary, PrimaryReplicaRouter
+from core.images import thumbnail_name
+from core.middleware import (check_pin_cache, pin_key,
+                             ReplicaPinningMiddleware)
+from core.renderers import UJSONRenderer
+from core.signals.handlers import update_group_active
+from core.tasks import execute, ThreadPoolBackend
+from core.test_runner import (DebugSQLTimingTestResult, partition,
+                              ParallelTestRunner)
 from core.models import (User, Group, Community, Chat,
-                         Message, ChatInvitation, GroupInvitation)
-
-
+                         Message, ChatInvitation, GroupInvitation,
+                         RetentionPolicy, PurgeCheckpoint, GroupAffinity,
+                         ChangeLogEntry, InboxEntry)
+
+# Runs the tasks in the thread that enqueues them, so that
+# their effects are visible to the tests.
+eager_tasks = override_settings(TASK_QUEUE={
+    'BACKEND': 'core.tasks.ThreadPoolBackend',
+    'OPTIONS': {'eager': True},
+})
+
+PASSWORD = make_password('password')
+
+
+def create_users(*usernames):
+    """Creates the users, along with their tokens, in bulk. Hashing
+    the password once and skipping `post_save` keeps the fixtures
+    fast. Returns the users in the order of `usernames`."""
+    User.objects.bulk_create(
+        User(username=name, email='%s@test.t' % name, password=PASSWORD)
+        for name in usernames)
+    users = {u.username: u
+             for u in User.objects.filter(username__in=usernames)}
+    Token.objects.bulk_create(Token(user=u, key=Token().generate_key())
+                              for u in users.values())
+    return [users[name] for name in usernames]
+
+
+@eager_tasks
 class TestUserAssociationWithJoinableFromUrls(APITestCase):
     """User being associated with the entities she
     creates."""
 
-    def setUp(self):
-        User.objects.create_user('test1', 'test1@test.t', 'test1')
-
-        u = User.objects.create_user('user1', 'user1@test.t', 'user1')
+    @classmethod
+    def setUpTestData(cls):
+        _, u = create_users('test1', 'user1')
         c = Community.objects.create(name='community1')
         g = Group.objects.create(name='group1', community=c)
         c = Chat.objects.create(name='group_chat1', group=g)
         Message.objects.create(content='test', sender=u,
                                chat=c)
-        self.user = User.objects.get(username='user1')
-        self.token = Token.objects.get(user=self.user).key
+        cls.user = u
+        cls.token = Token.objects.get(user=u).key
+
+    def setUp(self):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token)
 
     def test_add_group_tied_to_user(self):
@@ -95,28 +154,27 @@ class TestUserAssociationWithJoinableFromUrls(APITestCase):
         self.assertTrue(chat_invitation.exists())
 
 
+@eager_tasks
 class TestFilterEntitiesByLoggedUser(APITestCase):
     """Only the entities associated with the current user
     are returned.
     """
 
-    def setUp(self):
-        tu1 = User.objects.create_user('test1', 'test1@test.t', 'test1')
-        tu2 = User.objects.create_user('test2', 'test2@test.t', 'test2')
-        # tu3 = User.objects.create_user('test3', 'test2@test.t', 'test3')
-
-        u = User.objects.create_user('user1', 'user1@test.t', 'user1')
+    @classmethod
+    def setUpTestData(cls):
+        tu1, tu2, u = create_users('test1', 'test2', 'user1')
         c = Community.objects.create(name='community1')
         c.users.add(u, tu1, tu2)
         g = Group.objects.create(name='group1', community=c)
-        self.c = c
+        cls.c = c
         c = Chat.objects.create(name='group_chat1', group=g)
         c.users.add(u, tu1, tu2)
         Message.objects.create(content='test', sender=u,
                                chat=c)
-        self.user = User.objects.get(username='user1')
-        print(self.user)
-        self.token = Token.objects.get(user=self.user).key
+        cls.user = u
+        cls.token = Token.objects.get(user=u).key
+
+    def setUp(self):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token)
 
     def test_get_communities_of_logged_user(self):
@@ -144,6 +202,7 @@ class TestFilterEntitiesByLoggedUser(APITestCase):
         self.assertListEqual(groups_response, groups_user)
 
 
+@eager_tasks
 class TestChatAcceptRejectInvitation(APITestCase):
     """Mechanics for accepting and rejecting invitations. Due
     to the fact that GroupInvitation and ChatInvitation share
@@ -151,17 +210,18 @@ class TestChatAcceptRejectInvitation(APITestCase):
     by extension, is assumed to be correct.
     """
 
-    def setUp(self):
-        User.objects.create_user('test1', 't@t.t', 'test1')
+    @classmethod
+    def setUpTestData(cls):
+        cls.invitee, cls.user = create_users('test1', 'user1')
         c = Chat.objects.create(name='chat1')
-        self.user = User.objects.create_user('user1', 'u@u.u', 'user1')
+        cls.invitation = ChatInvitation.objects.create(
+            inviter=cls.user,
+            invitee=cls.invitee,
+            chat=c)
+
+    def setUp(self):
         token = Token.objects.get(user=self.user).key
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
-        self.invitee = User.objects.get(username='test1')
-        self.invitation = ChatInvitation.objects.create(
-            inviter=self.user,
-            invitee=self.invitee,
-            chat=c)
 
     def perform_action(self, action, token):
         """Performs the given action to an invitation.
@@ -205,20 +265,20 @@ class TestChatAcceptRejectInvitation(APITestCase):
         self.assertEquals(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+@eager_tasks
 class TestSentReceivedChatInvitations(APITestCase):
     """Tests views for gettting the invitations that a user has
     sent and received. Same as before, we only test `ChatInvitation`"""
 
-    def setUp(self):
-        """Create 3 users, u1, u2 and u3. Each one of these is going
-        to send 2 invitations to the other two, so in total, every
-        user will have 2 sent invitations and 2 received invitations."""
-        self.u1 = User.objects.create_user('u1', 'u1@u1.u1', 'u1')
-        self.u2 = User.objects.create_user('u2', 'u2@u2.u2', 'u1')
+    @classmethod
+    def setUpTestData(cls):
+        """Create 2 users, u1 and u2. u1 sends an invitation
+        to u2."""
+        cls.u1, cls.u2 = create_users('u1', 'u2')
         c = Chat.objects.create(name='c1')
-        ChatInvitation.objects.create(
-            inviter=self.u1,
-            invitee=self.u2,
+        cls.invitation = ChatInvitation.objects.create(
+            inviter=cls.u1,
+            invitee=cls.u2,
             chat=c
         )
 
@@ -226,7 +286,8 @@ class TestSentReceivedChatInvitations(APITestCase):
         """Checks that the specific type of invitations belong to
         the user."""
         t = Token.objects.get(user=user).key
-        should_be = ['http://testserver/chatinvitations/1/']
+        should_be = ['http://testserver/chatinvitations/%d/' %
+                     self.invitation.id]
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + t)
         response = self.client.get('/chatinvitations/%s/' % type_)
         self.assertEquals(response.status_code, status.HTTP_200_OK)
@@ -240,3 +301,638 @@ class TestSentReceivedChatInvitations(APITestCase):
     def test_received_invitations(self):
         """User sees sent invitations."""
         self.check_invitations(self.u2, 'received')
+
+
+@eager_tasks
+class TestChatExport(APITestCase):
+    """Streaming export of the history of a chat."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, = create_users('u1')
+        cls.chat = Chat.objects.create(name='c1')
+        cls.chat.users.add(cls.user)
+        for i in range(3):
+            Message.objects.create(content='message%d' % i,
+                                   sender=cls.user, chat=cls.chat)
+
+    def setUp(self):
+        token = Token.objects.get(user=self.user).key
+        self.auth = 'Token ' + token
+        self.client.credentials(HTTP_AUTHORIZATION=self.auth)
+
+    def export(self, **params):
+        """Performs the export and returns the body of the
+        streamed response."""
+        response = self.client.get('/chats/%d/export/' % self.chat.id,
+                                   params)
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content)
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_export_pinned_to_primary(self):
+        """The export of a pinned client reads from the primary even
+        though the body is streamed after the request is unpinned."""
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=self.auth)
+        cache.set(pin_key(request), True)
+        body = self.export().decode('utf-8')
+        self.assertEquals(len(body.splitlines()), 3)
+
+    def test_export_ndjson(self):
+        """Every message is a JSON line, oldest first."""
+        body = self.export().decode('utf-8')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertListEqual([r['content'] for r in rows],
+                             ['message0', 'message1', 'message2'])
+        self.assertEquals(rows[0]['sender'], 'u1')
+
+    def test_export_csv_gzip(self):
+        """The CSV export can be gzip compressed."""
+        body = gzip.decompress(self.export(type='csv', compress='gzip'))
+        rows = list(csv.reader(body.decode('utf-8').splitlines()))
+        self.assertListEqual(rows[0], ['id', 'date_sent', 'sender',
+                                       'content'])
+        self.assertEquals(len(rows), 4)
+
+    def test_export_since(self):
+        """Only the messages sent after `since` are exported."""
+        last = self.chat.messages.order_by('-id')[1]
+        body = self.export(since=last.date_sent.isoformat())
+        self.assertEquals(len(body.decode('utf-8').splitlines()), 1)
+
+    def test_export_invalid_type(self):
+        """Unknown export types are rejected."""
+        response = self.client.get('/chats/%d/export/' % self.chat.id,
+                                   {'type': 'xml'})
+        self.assertEquals(response.status_code,
+                          status.HTTP_400_BAD_REQUEST)
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@eager_tasks
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestPictureThumbnails(APITestCase):
+    """Thumbnails are generated for uploaded pictures and
+    shared between pictures with the same content."""
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, = create_users('u1')
+        buf = BytesIO()
+        Image.new('RGB', (640, 480), 'red').save(buf, 'PNG')
+        cls.content = buf.getvalue()
+
+    def test_thumbnails_generated(self):
+        """Every variant is stored under the hash of the picture."""
+        c = Community.objects.create(name='c1')
+        c.picture.save('c1.png', ContentFile(self.content))
+        c.refresh_from_db()
+        self.assertTrue(c.picture_hash)
+        name = thumbnail_name(c.picture_hash, 'small')
+        with default_storage.open(name) as thumbnail:
+            self.assertEquals(Image.open(thumbnail).size, (64, 64))
+
+    def test_thumbnails_shared(self):
+        """Two pictures with the same content share thumbnails."""
+        c1 = Community.objects.create(name='c1')
+        c1.picture.save('c1.png', ContentFile(self.content))
+        c2 = Community.objects.create(name='c2')
+        c2.picture.save('c2.png', ContentFile(self.content))
+        c1.refresh_from_db()
+        c2.refresh_from_db()
+        self.assertEquals(c1.picture_hash, c2.picture_hash)
+
+    def test_unchanged_picture_not_processed(self):
+        """Saving other fields does not process the picture again."""
+        c = Community.objects.create(name='c1')
+        c.picture.save('c1.png', ContentFile(self.content))
+        c = Community.objects.get(pk=c.pk)
+        c.picture_hash = ''
+        c.save()
+        c.save()
+        c.refresh_from_db()
+        self.assertEquals(c.picture_hash, '')
+
+    def test_new_picture_clears_hash(self):
+        """A new picture is served as is until its thumbnails are
+        generated, instead of the thumbnails of the previous one."""
+        c = Community.objects.create(name='c1', picture_hash='a' * 40)
+        with self.assertLogs('core.tasks', 'ERROR'):
+            c.picture.save('c1.png', ContentFile(b'not a picture'))
+        c.refresh_from_db()
+        self.assertEquals(c.picture_hash, '')
+
+    def test_serializer_thumbnail_urls(self):
+        """The serializer emits the URL of every variant."""
+        c = Community.objects.create(name='c1')
+        c.users.add(self.user)
+        c.picture.save('c1.png', ContentFile(self.content))
+        c.refresh_from_db()
+        token = Token.objects.get(user=self.user).key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        response = self.client.get('/communities/%d/' % c.id)
+        thumbnails = response.data['picture_thumbnails']
+        self.assertTrue(thumbnails['medium'].endswith(
+            thumbnail_name(c.picture_hash, 'medium')))
+
+
+@eager_tasks
+class TestTaskQueue(APITestCase):
+    """Side effects of the signals run through the task queue."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_users('u0', 'u1', 'u2')
+        cls.community = Community.objects.create(name='c1')
+
+    def test_group_activated(self):
+        """A group becomes active with 3 members."""
+        g = Group.objects.create(name='g1', community=self.community)
+        for user in self.users:
+            g.users.add(user)
+        self.assertTrue(Group.objects.get(pk=g.pk).is_active)
+
+    def test_empty_group_deleted(self):
+        """A group is deleted when its last member leaves."""
+        g = Group.objects.create(name='g1', community=self.community)
+        u = self.users[0]
+        g.users.add(u)
+        u.c_groups.remove(g)
+        self.assertFalse(Group.objects.filter(pk=g.pk).exists())
+
+    def test_programming_errors_not_retried(self):
+        """A broken task raises instead of being retried."""
+        retries = []
+        envelope = {'task': update_group_active.name, 'args': [],
+                    'key': None, 'attempts': 0}
+        with self.assertLogs('core.tasks', 'ERROR'):
+            self.assertRaises(TypeError, execute, envelope,
+                              lambda env, delay: retries.append(env))
+        self.assertListEqual(retries, [])
+
+    def test_unknown_task_dropped(self):
+        """Tasks that are not registered are logged and dropped."""
+        envelope = {'task': 'core.missing', 'args': [], 'key': None,
+                    'attempts': 0}
+        with self.assertLogs('core.tasks', 'ERROR'):
+            execute(envelope, None)
+
+    def test_pending_tasks_deduplicated(self):
+        """Tasks with the same key are queued only once, and the
+        queue reports its depth and lag."""
+        queue = ThreadPoolBackend(workers=1)
+        queue.executor.submit = lambda *args: None
+        envelope = {'task': update_group_active.name, 'args': [1],
+                    'key': 'group-active:1', 'attempts': 0}
+        queue.push(envelope)
+        queue.push(envelope)
+        self.assertEquals(queue.depth(), 1)
+        self.assertGreaterEqual(queue.lag(), 0)
+
+
+@eager_tasks
+class TestSuggestedGroups(APITestCase):
+    """Groups are suggested from the co-membership index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.friend, stranger = create_users('u1', 'u2', 'u3')
+        c = Community.objects.create(name='c1')
+        cls.mine = Group.objects.create(name='mine', community=c)
+        cls.shared = Group.objects.create(name='shared', community=c)
+        cls.lonely = Group.objects.create(name='lonely', community=c)
+        cls.mine.users.add(cls.user, cls.friend)
+        cls.friend.c_groups.add(cls.shared)
+        cls.lonely.users.add(stranger)
+
+    def setUp(self):
+        token = Token.objects.get(user=self.user).key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+    def suggested(self):
+        response = self.client.get('/groups/suggested/')
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        return [x['name'] for x in response.data]
+
+    def test_groups_of_co_members_suggested(self):
+        """Groups of the co-members are suggested, the groups of the
+        user and unrelated groups are not."""
+        self.assertListEqual(self.suggested(), ['shared'])
+
+    def test_joined_group_not_suggested(self):
+        """A group stops being suggested once the user joins it."""
+        self.shared.users.add(self.user)
+        self.assertListEqual(self.suggested(), [])
+
+    def weights(self):
+        return {(a.group_id, a.other_id): a.weight
+                for a in GroupAffinity.objects.all()}
+
+    def test_weights_follow_memberships(self):
+        """Joins and leaves update the weights as a full rebuild
+        of the index would."""
+        self.friend.c_groups.add(self.lonely)
+        self.user.c_groups.add(self.shared, self.lonely)
+        self.mine.users.remove(self.friend, self.user.pk + 1000)
+        self.user.c_groups.clear()
+        updated = self.weights()
+        GroupAffinity.objects.all().delete()
+        call_command('rebuildaffinity', stdout=StringIO())
+        self.assertDictEqual(updated, self.weights())
+        self.assertEquals(updated[self.shared.pk, self.lonely.pk], 1)
+
+    def test_rebuild_existing_memberships(self):
+        """The command builds the index of existing memberships."""
+        GroupAffinity.objects.all().delete()
+        self.assertListEqual(self.suggested(), [])
+        call_command('rebuildaffinity', stdout=StringIO())
+        self.assertListEqual(self.suggested(), ['shared'])
+
+
+@eager_tasks
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class TestSync(APITestCase):
+    """Incremental sync from the changelog."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.other = create_users('u1', 'u2')
+        cls.chat = Chat.objects.create(name='c1')
+        cls.chat.users.add(cls.user)
+        cls.hidden = Chat.objects.create(name='hidden')
+
+    def setUp(self):
+        token = Token.objects.get(user=self.user).key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+    def sync(self, since=None):
+        params = {} if since is None else {'since': since}
+        response = self.client.get('/sync/', params)
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_initial_sync(self):
+        """Without a cursor, everything visible is returned."""
+        data = self.sync()
+        self.assertListEqual([x['name'] for x in data['chats']], ['c1'])
+        self.assertFalse(data['more'])
+
+    def test_changes_since_cursor(self):
+        """Only the changes after the cursor are returned."""
+        cursor = self.sync()['next']
+        Message.objects.create(content='hello', sender=self.user,
+                               chat=self.chat)
+        data = self.sync(cursor)
+        self.assertListEqual(data['chats'], [])
+        self.assertListEqual([x['content'] for x in data['messages']],
+                             ['hello'])
+
+    def test_left_entity_removed(self):
+        """Entities that the user left are reported as removed."""
+        cursor = self.sync()['next']
+        self.user.chats.remove(self.chat)
+        data = self.sync(cursor)
+        self.assertListEqual(data['removed']['chats'], [self.chat.id])
+
+    def test_removed_entities(self):
+        """Deleted entities are reported as removed to their members."""
+        message = Message.objects.create(content='hello', sender=self.user,
+                                         chat=self.chat)
+        message_id = message.id
+        cursor = self.sync()['next']
+        message.delete()
+        data = self.sync(cursor)
+        self.assertListEqual(data['removed']['messages'], [message_id])
+        Chat.objects.get(pk=self.chat.pk).delete()
+        data = self.sync(data['next'])
+        self.assertListEqual(data['removed']['chats'], [self.chat.id])
+
+    def test_members_not_embedded(self):
+        """Entities are synced without their members and messages."""
+        Message.objects.create(content='hello', sender=self.user,
+                               chat=self.chat)
+        chat = self.sync()['chats'][0]
+        self.assertNotIn('users', chat)
+        self.assertNotIn('messages', chat)
+
+    @override_settings(SYNC_CHANGELOG_DAYS=1)
+    def test_purged_cursor_resets(self):
+        """Clients whose cursor was purged get a new snapshot."""
+        Message.objects.create(content='hello', sender=self.user,
+                               chat=self.chat)
+        cursor = self.sync()['next']
+        ChangeLogEntry.objects.update(
+            created_on=timezone.now() - timedelta(days=2))
+        call_command('purge', 'changelog', sleep=0, stdout=StringIO())
+        self.assertFalse(ChangeLogEntry.objects.exists())
+        data = self.sync(cursor)
+        self.assertTrue(data['reset'])
+        self.assertListEqual([x['name'] for x in data['chats']], ['c1'])
+
+    def test_changes_of_others_not_scanned(self):
+        """Changes to entities of other users do not reach the
+        changelog of the user."""
+        cursor = self.sync()['next']
+        self.hidden.users.add(self.other)
+        Message.objects.create(content='secret', sender=self.other,
+                               chat=self.hidden)
+        data = self.sync(cursor)
+        self.assertEquals(data['next'], cursor)
+        self.assertListEqual(data['messages'], [])
+
+    @override_settings(SYNC_SETTLE_SECONDS=60)
+    def test_cursor_held_back(self):
+        """Recent changes are returned, but the cursor does not move
+        past them until they are settled."""
+        Message.objects.create(content='hello', sender=self.user,
+                               chat=self.chat)
+        data = self.sync(0)
+        self.assertListEqual([x['content'] for x in data['messages']],
+                             ['hello'])
+        self.assertEquals(data['next'], '0')
+        self.assertFalse(data['more'])
+
+    def test_invalid_cursor(self):
+        """Cursors that were not issued by the API are rejected."""
+        response = self.client.get('/sync/', {'since': 'abc'})
+        self.assertEquals(response.status_code,
+                          status.HTTP_400_BAD_REQUEST)
+
+
+@eager_tasks
+class TestRenderers(APITestCase):
+    """Responses and requests in every negotiated format."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, = create_users('u1')
+        cls.chat = Chat.objects.create(name='chát')
+        cls.chat.users.add(cls.user)
+
+    def setUp(self):
+        token = Token.objects.get(user=self.user).key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+    def test_json_list(self):
+        """JSON is the default format."""
+        response = self.client.get('/chats/')
+        self.assertEquals(response['Content-Type'], 'application/json')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEquals(data['results'][0]['name'], 'chát')
+
+    def test_msgpack_list(self):
+        """MessagePack is returned when it is accepted."""
+        response = self.client.get('/chats/',
+                                   HTTP_ACCEPT='application/msgpack')
+        self.assertEquals(response['Content-Type'], 'application/msgpack')
+        data = msgpack.unpackb(response.content, encoding='utf-8')
+        self.assertEquals(data['results'][0]['name'], 'chát')
+
+    def test_msgpack_create_message(self):
+        """Messages can be sent as MessagePack."""
+        body = msgpack.packb({'chat': '/chats/%d/' % self.chat.id,
+                              'sender': '/users/%d/' % self.user.id,
+                              'content': 'hola'}, use_bin_type=True)
+        response = self.client.post('/messages/', body,
+                                    content_type='application/msgpack',
+                                    HTTP_ACCEPT='application/msgpack')
+        self.assertEquals(response.status_code, status.HTTP_201_CREATED)
+        data = msgpack.unpackb(response.content, encoding='utf-8')
+        self.assertEquals(data['content'], 'hola')
+
+    def test_json_serializer_types(self):
+        """Dates and decimals of serializers are rendered as the
+        default renderer does."""
+        class Sample(serializers.Serializer):
+            date = serializers.DateTimeField()
+            price = serializers.DecimalField(max_digits=5, decimal_places=2)
+        data = Sample({'date': datetime(2015, 1, 1, 12, 30),
+                       'price': Decimal('1.10')}).data
+        rendered = UJSONRenderer().render(data)
+        self.assertEquals(rendered, JSONRenderer().render(data))
+        self.assertEquals(json.loads(rendered.decode('utf-8')),
+                          {'date': '2015-01-01T12:30:00', 'price': '1.10'})
+
+    def test_json_unsupported_types(self):
+        """Data that ujson can not encode is rendered by the default
+        renderer."""
+        data = {'id': 2 ** 70}
+        self.assertEquals(UJSONRenderer().render(data),
+                          JSONRenderer().render(data))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class TestReplicaRouting(SimpleTestCase):
+    """Reads go to the replicas unless the client has just
+    written."""
+
+    def setUp(self):
+        cache.clear()
+        self.router = PrimaryReplicaRouter()
+        self.middleware = ReplicaPinningMiddleware()
+        self.factory = RequestFactory(HTTP_AUTHORIZATION='Token test')
+
+    def request(self, method):
+        request = getattr(self.factory, method)('/messages/')
+        self.middleware.process_request(request)
+        db = self.router.db_for_read(Message)
+        self.middleware.process_response(request, None)
+        return db
+
+    def test_reads_to_replica(self):
+        """Reads go to a replica and writes to the primary."""
+        self.assertEquals(self.router.db_for_read(Message), 'replica')
+        self.assertEquals(self.router.db_for_write(Message), 'default')
+
+    def test_pinned_reads_to_primary(self):
+        """Reads go to the primary while pinned."""
+        with pin_primary():
+            self.assertEquals(self.router.db_for_read(Message), 'default')
+        self.assertFalse(is_pinned())
+
+    def test_reads_after_write_to_primary(self):
+        """A client reads from the primary right after writing."""
+        self.assertEquals(self.request('get'), 'replica')
+        self.assertEquals(self.request('post'), 'default')
+        self.assertEquals(self.request('get'), 'default')
+
+    def test_local_cache_refused(self):
+        """Replicas require a cache shared by the workers."""
+        self.assertRaises(ImproperlyConfigured, check_pin_cache)
+        backend = 'django.core.cache.backends.memcached.MemcachedCache'
+        with override_settings(CACHES={'default': {'BACKEND': backend}}):
+            check_pin_cache()
+
+    @override_settings(REPLICA_PIN_SECONDS=0)
+    def test_pin_expires(self):
+        """The pin expires after REPLICA_PIN_SECONDS."""
+        self.request('post')
+        self.assertEquals(self.request('get'), 'replica')
+
+
+@eager_tasks
+class TestInbox(APITestCase):
+    """Chats are listed by their last activity."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, = create_users('u1')
+        cls.old = Chat.objects.create(name='old')
+        cls.new = Chat.objects.create(name='new')
+        cls.user.chats.add(cls.old, cls.new)
+
+    def setUp(self):
+        token = Token.objects.get(user=self.user).key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+    def send(self, chat, content):
+        response = self.client.post('/messages/', {
+            'chat': '/chats/%d/' % chat.id,
+            'sender': '/users/%d/' % self.user.id,
+            'content': content})
+        self.assertEquals(response.status_code, status.HTTP_201_CREATED)
+
+    def inbox(self):
+        response = self.client.get('/chats/', {'ordering': '-last_activity'})
+        return [x['name'] for x in response.data['results']]
+
+    def test_ordered_by_last_activity(self):
+        """The chat with the most recent message comes first."""
+        self.send(self.new, 'first')
+        self.send(self.old, 'second')
+        self.assertListEqual(self.inbox(), ['old', 'new'])
+        chat = Chat.objects.get(pk=self.old.pk)
+        self.assertEquals(chat.last_message.content, 'second')
+
+    def test_activity_not_moved_backwards(self):
+        """A message recorded late does not replace a newer one."""
+        self.send(self.old, 'first')
+        self.send(self.old, 'second')
+        chat = Chat.objects.get(pk=self.old.pk)
+        chat.record_message(chat.messages.get(content='first'))
+        chat = Chat.objects.get(pk=self.old.pk)
+        self.assertEquals(chat.last_message.content, 'second')
+        entry = chat.inbox_entries.get(user=self.user)
+        self.assertEquals(entry.last_activity_at, chat.last_activity_at)
+
+    def test_messages_not_listed(self):
+        """The inbox lists the chats without their messages."""
+        self.send(self.new, 'first')
+        response = self.client.get('/chats/', {'ordering': '-last_activity'})
+        self.assertNotIn('messages', response.data['results'][0])
+
+    def test_backfill(self):
+        """Existing memberships get their inbox entries."""
+        self.send(self.old, 'first')
+        InboxEntry.objects.all().delete()
+        Chat.objects.update(last_message=None, last_activity_at=None)
+        call_command('backfillinbox', batch_size=1, stdout=StringIO())
+        self.assertListEqual(self.inbox(), ['old', 'new'])
+        call_command('backfillinbox', stdout=StringIO())
+        self.assertEquals(InboxEntry.objects.count(), 2)
+
+    def test_left_chat_not_in_inbox(self):
+        """Chats that the user left are removed from the inbox."""
+        self.old.users.remove(self.user)
+        self.assertListEqual(self.inbox(), ['new'])
+
+
+@eager_tasks
+@override_settings(RETENTION_DEFAULTS={'message_days': None,
+                                       'invitation_days': 30})
+class TestPurge(APITestCase):
+    """Retention of messages and invitations."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.invitee = create_users('u1', 'u2')
+        c1 = Community.objects.create(name='c1')
+        c2 = Community.objects.create(name='c2')
+        RetentionPolicy.objects.create(community=c1, message_days=7)
+        cls.chat1 = cls.create_chat(c1)
+        cls.chat2 = cls.create_chat(c2)
+
+    @staticmethod
+    def create_chat(community):
+        g = Group.objects.create(name='g', community=community)
+        return Chat.objects.create(name='chat', group=g)
+
+    def create_message(self, chat, days_ago):
+        m = Message.objects.create(content='m', sender=self.user, chat=chat)
+        m.seen_by.add(self.user)
+        date = timezone.now() - timedelta(days=days_ago)
+        Message.objects.filter(pk=m.pk).update(date_sent=date)
+        return m
+
+    def purge(self):
+        call_command('purge', batch_size=1, sleep=0, stdout=StringIO())
+
+    def test_messages_purged_by_policy(self):
+        """Messages older than the retention of their community are
+        deleted with their receipts; the others are kept."""
+        self.chat1.users.add(self.user)
+        old = self.create_message(self.chat1, 10)
+        recent = self.create_message(self.chat1, 1)
+        kept = self.create_message(self.chat2, 10)
+        self.chat1.record_message(old)
+        self.purge()
+        self.assertListEqual(
+            list(Message.objects.order_by('pk').values_list('pk',
+                                                            flat=True)),
+            [recent.pk, kept.pk])
+        self.assertFalse(Message.seen_by.through.objects.filter(
+            message=old.pk).exists())
+        self.assertIsNone(Chat.objects.get(pk=self.chat1.pk).last_message)
+        self.assertEquals(ChangeLogEntry.objects.filter(
+            user=self.user, kind='message', object_id=old.pk,
+            action=ChangeLogEntry.REMOVED).count(), 1)
+
+    def test_stale_invitations_purged(self):
+        """Invitations older than the default retention are deleted."""
+        invitation = ChatInvitation.objects.create(
+            inviter=self.user, invitee=self.invitee, chat=self.chat2)
+        date = timezone.now() - timedelta(days=31)
+        ChatInvitation.objects.filter(pk=invitation.pk).update(
+            created_on=date)
+        self.purge()
+        self.assertFalse(ChatInvitation.objects.exists())
+
+    def test_resumes_from_checkpoint(self):
+        """Rows before the checkpoint are not scanned again until the
+        purge completes."""
+        old = self.create_message(self.chat1, 10)
+        PurgeCheckpoint.objects.create(job='messages', last_id=old.pk)
+        self.purge()
+        self.assertTrue(Message.objects.filter(pk=old.pk).exists())
+        self.assertEquals(
+            PurgeCheckpoint.objects.get(job='messages').last_id, 0)
+
+
+class TestParallelRunner(SimpleTestCase):
+    """Test cases are split between processes by class."""
+
+    def test_partition_keeps_classes(self):
+        """The tests of a class run in the same process."""
+        loader = unittest.defaultTestLoader
+        suite = unittest.TestSuite([
+            loader.loadTestsFromTestCase(TestSync),
+            loader.loadTestsFromTestCase(TestInbox),
+            loader.loadTestsFromTestCase(TestPurge)])
+        buckets = partition(suite, 2)
+        self.assertEquals(len(buckets), 2)
+        classes = [set(t.__class__ for t in b) for b in buckets]
+        self.assertFalse(classes[0] & classes[1])
+        self.assertEquals(sum(b.countTestCases() for b in buckets),
+                          suite.countTestCases())
+
+    def test_debug_sql(self):
+        """`--debug-sql` prints the queries of the failed tests."""
+        self.assertIs(ParallelTestRunner(debug_sql=True).get_resultclass(),
+                      DebugSQLTimingTestResult)
@@ -14,6 +14,7 @@ router.register(r'groupinvitations', views.GroupInvitationViewSet,
                 'groupinvitation')
 router.register(r'chatinvitations', views.ChatInvitationViewSet,
                 'chatinvitation')
+router.register(r'sync', views.SyncViewSet, 'sync')
 
 urlpatterns = [
     url(r'^', include(router.urls)),
@@ -1,13 +1,26 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.response import Response
 from rest_framework import viewsets
 from rest_framework import status
 
-from .models import (Community, Group, Chat, Message, User)
+from .db import is_pinned
+from .export import export_messages, EXPORT_CONTENT_TYPES
+from .models import (Community, Group, Chat, Message, User,
+                     ChangeLogEntry)
 from .serializers import (CommunitySerializer, UserSerializer, GroupSerializer,
                           GroupInvitationSerializer, ChatInvitationSerializer,
-                          ChatSerializer, MessageSerializer)
+                          ChatSerializer, MessageSerializer,
+                          CommunitySummarySerializer, GroupSummarySerializer,
+                          ChatSummarySerializer, MessageSummarySerializer)
 from .permissions import BelongsTo
+from .recommendations import suggested_groups
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -51,22 +64,102 @@ class GroupViewSet(viewsets.ModelViewSet):
         g_obj = serializer.save()
         g_obj.users.add(self.request.user)
 
+    @list_route()
+    def suggested(self, request):
+        """Returns the groups that share the most members with the
+        groups of the logged user, most related first."""
+        groups = suggested_groups(request.user)
+        serializer = self.get_serializer(groups, many=True)
+        return Response(serializer.data)
+
 
 class ChatViewSet(viewsets.ModelViewSet):
     """Exposes the API for the private chats."""
     serializer_class = ChatSerializer
     permissions_classes = (BelongsTo,)
 
+    def inbox_ordering(self):
+        ordering = self.request.query_params.get('ordering')
+        if ordering in ('last_activity', '-last_activity'):
+            return ordering
+        return None
+
+    def get_serializer_class(self):
+        """The inbox is listed without the members and messages of
+        the chats, so that a page is read from the inbox index alone."""
+        if self.action == 'list' and self.inbox_ordering():
+            return ChatSummarySerializer
+        return ChatSerializer
+
     def get_queryset(self):
         """Filters the chats based on the user
-        that is logged in."""
+        that is logged in. With `?ordering=-last_activity` (or
+        `last_activity`), the chats are listed from the inbox of
+        the user, ordered by their last message."""
         user = self.request.user
+        ordering = self.inbox_ordering()
+        if ordering:
+            order = ordering.replace('last_activity',
+                                     'inbox_entries__last_activity_at')
+            return (Chat.objects.filter(inbox_entries__user=user)
+                                .order_by(order))
         return Chat.objects.filter(users=user)
 
     def perform_create(self, serializer):
         c_obj = serializer.save()
         c_obj.users.add(self.request.user)
 
+    @detail_route()
+    def export(self, request, pk=None):
+        """Streams the whole history of the chat, oldest message
+        first. The following query parameters are accepted:
+
+        * `type`: `ndjson` (default) or `csv`.
+        * `compress`: `gzip` to compress the output.
+        * `since`/`until`: ISO 8601 datetimes that limit the
+          messages to the ones sent after `since` and up to `until`,
+          so that incremental exports only fetch new messages.
+        """
+        chat = self.get_object()
+        type_ = request.query_params.get('type', 'ndjson')
+        compress = request.query_params.get('compress')
+        if type_ not in EXPORT_CONTENT_TYPES:
+            message = "Unknown export type '%s'" % type_
+            return Response(data={'detail': message},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if compress not in (None, 'gzip'):
+            message = "Unknown compression '%s'" % compress
+            return Response(data={'detail': message},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        messages = chat.messages.all()
+        for param, lookup in (('since', 'date_sent__gt'),
+                              ('until', 'date_sent__lte')):
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+            date = parse_datetime(value)
+            if date is None:
+                message = "Invalid datetime for '%s'" % param
+                return Response(data={'detail': message},
+                                status=status.HTTP_400_BAD_REQUEST)
+            messages = messages.filter(**{lookup: date})
+        if is_pinned():
+            # The body is read after the middleware unpins the thread.
+            messages = messages.using('default')
+
+        filename = 'chat-%d.%s' % (chat.id, type_)
+        content_type = EXPORT_CONTENT_TYPES[type_]
+        if compress:
+            filename += '.gz'
+            content_type = 'application/gzip'
+        response = StreamingHttpResponse(
+            export_messages(messages, type_, compress=bool(compress)),
+            content_type=content_type)
+        response['Content-Disposition'] = ('attachment; filename=%s' %
+                                           filename)
+        return response
+
 
 class MessageViewSet(viewsets.ModelViewSet):
     """Exposes API for messages."""
@@ -79,8 +172,10 @@ class MessageViewSet(viewsets.ModelViewSet):
         return Message.objects.filter(users=user)
 
     def perform_create(self, serializer):
-        """Sets the sender to be the current user."""
-        serializer.save(sender=self.request.user)
+        """Sets the sender to be the current user and records the
+        message as the last activity of its chat."""
+        message = serializer.save(sender=self.request.user)
+        message.chat.record_message(message)
 
 
 class InvitationViewSet(viewsets.ModelViewSet):
@@ -184,3 +279,114 @@ class ChatInvitationViewSet(InvitationViewSet):
     @detail_route(methods=['post'])
     def accept(self, request, pk=None):
         return super().accept(request, 'chat', pk)
+
+
+class SyncViewSet(viewsets.ViewSet):
+    """Exposes the changes since a cursor returned by a
+    previous sync."""
+    SYNC_SIZE = 500
+    kinds = (
+        ('communities', 'community', CommunitySummarySerializer),
+        ('groups', 'group', GroupSummarySerializer),
+        ('chats', 'chat', ChatSummarySerializer),
+        ('messages', 'message', MessageSummarySerializer),
+    )
+
+    def visible(self, kind, ids=None):
+        """Returns the entities of the given kind, and ids if given,
+        that the logged user can see."""
+        user = self.request.user
+        if kind == 'message':
+            objs = Message.objects.filter(chat__users=user)
+        else:
+            model = {'community': Community, 'group': Group,
+                     'chat': Chat}[kind]
+            objs = model.objects.filter(users=user)
+        if ids is not None:
+            objs = objs.filter(pk__in=ids)
+        return objs.order_by('pk')
+
+    def settled(self):
+        """Returns the date before which every changelog entry is
+        committed. Ids are allocated before their transaction commits,
+        so a recent entry may still be followed by a lower id that
+        is not visible yet. The cursor is never moved past entries
+        younger than `SYNC_SETTLE_SECONDS`, which must be longer than
+        any transaction, so that no entry is skipped."""
+        return timezone.now() - timedelta(
+            seconds=settings.SYNC_SETTLE_SECONDS)
+
+    def list(self, request):
+        """Returns the entities that the logged user can see and that
+        were created, updated or had membership changes after the
+        `since` cursor, along with the ids of the entities that the
+        user left or that were removed. At most `SYNC_SIZE` changes
+        are processed per request: while `more` is true, the client
+        should sync again from the `next` cursor.
+
+        Without `since`, or when the entries after it were purged,
+        returns a snapshot of the communities, groups and chats of
+        the user with `reset` set, and the cursor to sync from. The
+        client must then replace what it holds with the snapshot."""
+        entries = ChangeLogEntry.objects.filter(user=request.user)
+        since = request.query_params.get('since')
+        if since is None:
+            return self.snapshot(request, entries)
+        try:
+            since = int(since)
+        except ValueError:
+            return Response(data={'detail': 'Invalid sync cursor'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        # Cursors are ids of entries of the user, which are only
+        # deleted by the purge of the changelog.
+        if since and not entries.filter(pk=since).exists():
+            return self.snapshot(request, entries)
+
+        batch = list(entries.filter(pk__gt=since)
+                            .order_by('pk')[:self.SYNC_SIZE + 1])
+        more = len(batch) > self.SYNC_SIZE
+        batch = batch[:self.SYNC_SIZE]
+        settled = self.settled()
+        cursor = since
+        changed = {kind: set() for _, kind, _ in self.kinds}
+        removed = {kind: set() for _, kind, _ in self.kinds}
+        for entry in batch:
+            changed[entry.kind].add(entry.object_id)
+            if entry.action in (ChangeLogEntry.LEFT, ChangeLogEntry.REMOVED):
+                removed[entry.kind].add(entry.object_id)
+        for entry in batch:
+            if entry.created_on > settled:
+                break
+            cursor = entry.pk
+
+        context = {'request': request}
+        data = {
+            'next': str(cursor),
+            'more': more and cursor != since,
+            'reset': False,
+            'removed': {},
+        }
+        for name, kind, serializer_class in self.kinds:
+            objs = self.visible(kind, changed[kind]) if changed[kind] else []
+            data[name] = serializer_class(objs, many=True,
+                                          context=context).data
+            data['removed'][name] = sorted(
+                removed[kind] - set(obj.pk for obj in objs))
+        return Response(data)
+
+    def snapshot(self, request, entries):
+        """Returns every community, group and chat of the user, and
+        the last settled entry of the user as the cursor. Entries
+        after the cursor are sent again by the next sync, which is
+        harmless as entities are sent whole."""
+        cursor = (entries.filter(created_on__lte=self.settled())
+                         .aggregate(cursor=Max('pk'))['cursor'])
+        context = {'request': request}
+        data = {'next': str(cursor or 0), 'more': False, 'reset': True,
+                'removed': {}}
+        for name, kind, serializer_class in self.kinds:
+            objs = self.visible(kind) if kind != 'message' else []
+            data[name] = serializer_class(objs, many=True,
+                                          context=context).data
+            data['removed'][name] = []
+        return Response(data)
@@ -36,7 +36,6 @@ INSTALLED_APPS = (
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'django_nose',
     'rest_framework',
     'rest_framework.authtoken',
     'rest_framework_swagger',
@@ -52,6 +51,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.ReplicaPinningMiddleware',
 )
 
 ROOT_URLCONF = 'la_comunita.urls'
@@ -64,6 +64,17 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.UJSONRenderer',
+        'core.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.parsers.UJSONParser',
+        'core.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 
@@ -96,6 +107,17 @@ DATABASES = {
     }
 }
 
+# Read replicas: aliases of DATABASES that receive the reads. Each
+# one should be declared with {'TEST': {'MIRROR': 'default'}}. The
+# default cache must then be shared by all the workers (e.g.
+# memcached), because it keeps the pins of REPLICA_PIN_SECONDS.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['core.db.PrimaryReplicaRouter']
+
+# Seconds during which the reads of a client go to the primary
+# database after it writes.
+REPLICA_PIN_SECONDS = 5
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
@@ -115,5 +137,34 @@ STATIC_URL = '/static/'
 # MEDIA_URL = '/media/'
 # MEDIA_ROOT = '/media/'
 
-# Tests
-TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'
+# Thumbnails of the pictures of users, communities, groups and chats.
+THUMBNAIL_SIZES = {
+    'small': (64, 64),
+    'medium': (256, 256),
+}
+
+# Days that messages and invitations are kept when their community
+# has no RetentionPolicy. None keeps them forever.
+RETENTION_DEFAULTS = {
+    'message_days': None,
+    'invitation_days': 90,
+}
+
+# Seconds after which a sync changelog entry is assumed committed.
+# Must be longer than any transaction that writes to the changelog.
+SYNC_SETTLE_SECONDS = 5
+
+# Days that sync changelog entries are kept. Clients that did not
+# sync for longer get a new snapshot.
+SYNC_CHANGELOG_DAYS = 30
+
+# Task queue for the side effects of the signals. To use Redis,
+# set the backend to 'core.tasks.RedisBackend' with the `url` of
+# the server in OPTIONS and run `python manage.py runtasks`.
+TASK_QUEUE = {
+    'BACKEND': 'core.tasks.ThreadPoolBackend',
+    'OPTIONS': {'workers': 4},
+}
+
+# Tests. Run with `--parallel N` to choose the number of processes.
+TEST_RUNNER = 'core.test_runner.ParallelTestRunner'
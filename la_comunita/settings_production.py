@@ -0,0 +1,49 @@
+"""
+Settings for the web workers in production.
+
+Only the apps and middleware needed by the token authenticated
+API are loaded, so that workers boot faster and use less memory.
+The admin, the API docs, the browsable API, sessions and messages
+are left to the default settings.
+
+The `SECRET_KEY` and `ALLOWED_HOSTS` environment variables must be
+set, see the README.
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # NOQA: Extends the default settings.
+from .settings import REST_FRAMEWORK
+
+DEBUG = False
+
+try:
+    SECRET_KEY = os.environ['SECRET_KEY']
+except KeyError:
+    raise ImproperlyConfigured('Set the SECRET_KEY environment variable.')
+
+# Comma separated hosts served by the workers. Without it no host is
+# allowed, so that a missing variable fails closed.
+ALLOWED_HOSTS = [host for host in os.environ.get('ALLOWED_HOSTS',
+                                                 '').split(',') if host]
+
+INSTALLED_APPS = (
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'rest_framework',
+    'rest_framework.authtoken',
+    'core'
+)
+
+MIDDLEWARE_CLASSES = (
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'core.middleware.ReplicaPinningMiddleware',
+)
+
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_RENDERER_CLASSES=(
+    'core.renderers.UJSONRenderer',
+    'core.renderers.MessagePackRenderer',
+))
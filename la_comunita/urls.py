@@ -12,12 +12,20 @@ Class-based views
 Including another URLconf
     1. Add an import:  from blog import urls as blog_urls
     2. Add a URL to urlpatterns:  url(r'^blog/', include(blog_urls))
+
+The admin and the API docs are only routed, and imported, when
+their apps are installed. See `la_comunita.settings_production`.
 """
+from django.apps import apps
 from django.conf.urls import include, url
-from django.contrib import admin
 
-urlpatterns = [
-    url(r'^admin/', include(admin.site.urls)),
-    url(r'^docs/', include('rest_framework_swagger.urls')),
-    url(r'^', include('core.urls'))
-]
+urlpatterns = []
+
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+    urlpatterns.append(url(r'^admin/', include(admin.site.urls)))
+
+if apps.is_installed('rest_framework_swagger'):
+    urlpatterns.append(url(r'^docs/', include('rest_framework_swagger.urls')))
+
+urlpatterns.append(url(r'^', include('core.urls')))